@@ -1,19 +1,24 @@
 import time
 import logging
-from multiprocessing import Process, Manager
+from multiprocessing import Process, Value
 from communication.stm32 import STMLink
 import sys
 import json
-import os
 import requests
 from consts import SYMBOL_MAP
 from settings import API_IP, API_PORT
 from ultralytics import YOLO
-# import subprocess
+import subprocess
 import numpy as np
 import cv2
 import math
-import os
+
+# libjpeg-turbo decodes the snapshots with SIMD Huffman and IDCT, OpenCV's own libjpeg is used without it
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    jpeg = TurboJPEG()
+except (ImportError, OSError):
+    jpeg = None
 
 # Initialize the YOLOv5 model
 # model = YOLO("best.pt")
@@ -24,6 +29,13 @@ classNames = ["arrow-bullseye", "bullseye-arrow", "bullseye-arrow-bullseye", "id
               "id20", "id21", "id22", "id23", "id24", "id25", "id26", "id27", "id28", "id29", "id30", "id31", "id32", "id33", "id34", "id35", "id36",
               "id37", "id38", "id39", "id40", "id99"]
 
+# Names by the class id the model reports, where ids 38 and 39 come out swapped.
+# Done once here instead of for every detection
+classNamesFixed = list(classNames)
+if len(classNamesFixed) > 39:
+    classNamesFixed[38], classNamesFixed[39] = classNames[39], classNames[38]
+classNamesFixed = tuple(classNamesFixed)
+
 lock_tables = {
     "ACK": 0,
     "FWACK": 1,
@@ -36,7 +48,15 @@ lock_tables = {
 }
 
 def capture_image(filename):
-    os.system(f"libcamera-still -e jpg -n -t 500 -o {filename} --awb auto > /dev/null 2>&1")
+    subprocess.run(["libcamera-still", "-e", "jpg", "-n", "-t", "500", "-o", filename, "--awb", "auto"],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def read_image(filename):
+    """Decodes a captured JPEG into a BGR image, like cv2.imread"""
+    if jpeg is None:
+        return cv2.imread(filename)
+    with open(filename, "rb") as file:
+        return jpeg.decode(file.read(), pixel_format=TJPF_BGR)
 
 class RaspberryPi:
     """
@@ -47,8 +67,8 @@ class RaspberryPi:
         Initializes the Raspberry Pi.
         """
         self.stm_link = STMLink()
-        self.manager = Manager()
-        self.movement_lock = self.manager.Value('i', 0)  # Using Value as a flag
+        # Using Value as a flag, kept in shared memory so that reads do not go through a Manager process
+        self.movement_lock = Value('i', 0, lock=False)
 
         # Initialize logger
         self.logger = logging.getLogger(__name__)
@@ -138,21 +158,22 @@ class RaspberryPi:
         :param obstacle_id_with_signal: the current obstacle ID followed by underscore followed by signal
         """
         # Lock the robot
-        self.movement_lock.value == 1
+        self.movement_lock.value = 1
 
         obstacle_id, signal = obstacle_id_with_signal.split("_")
         self.logger.info(f"Capturing image for obstacle id: {obstacle_id}")
         filename = f"{obstacle_id}_{signal}.jpg"
 
-        capture_image(filename)
-        self.logger.debug("Detecting image...")
-
-        # Read the captured image
-        img = cv2.imread(filename)
-        results = model(img, stream=True)
+        try:
+            capture_image(filename)
+            self.logger.debug("Detecting image...")
 
-        # release lock so that bot can continue moving
-        self.movement_lock.value == 0
+            # Read the captured image
+            img = read_image(filename)
+            results = model(img, stream=True)
+        finally:
+            # release lock so that bot can continue moving, even if the capture or detection failed
+            self.movement_lock.value = 0
 
         # Coordinates
         for r in results:
@@ -166,21 +187,19 @@ class RaspberryPi:
                 print("Confidence --->", confidence)
 
                 # Class name
-                cls = int(box.cls[0])
-                if cls == 38:
-                    cls = 39
-                elif cls == 39:
-                    cls = 38
-                print("Class name -->", classNames[cls])
+                name = classNamesFixed[int(box.cls[0])]
+                print("Class name -->", name)
 
 
         self.logger.info(f"results: {results}")
+        # The next move() spins until the flag is 0, so it has to be free once the snap is over
+        assert self.movement_lock.value == 0, "movement_lock still held after snap_and_rec"
 
 
 # Function to perform object detection on captured image
 def detect_objects_in_image():
     # Read the captured image
-    img = cv2.imread("image.jpg")
+    img = read_image("image.jpg")
 
     # Perform object detection
     results = model(img, stream=True)
@@ -202,12 +221,8 @@ def detect_objects_in_image():
             print("Confidence --->", confidence)
 
             # Class name
-            cls = int(box.cls[0])
-            if cls == 38:
-                cls = 39
-            elif cls == 39:
-                cls = 38
-            print("Class name -->", classNames[cls])
+            name = classNamesFixed[int(box.cls[0])]
+            print("Class name -->", name)
 
             # Object details
             org = [x1, y1]
@@ -216,7 +231,7 @@ def detect_objects_in_image():
             color = (0, 255, 0)
             thickness = 12
 
-            cv2.putText(img, classNames[cls], org, font, fontScale, color, thickness)
+            cv2.putText(img, name, org, font, fontScale, color, thickness)
 
     # Show the image
     cv2.imshow('Image', img)
@@ -1,38 +1,94 @@
 # _!/venv/bin/python
 
 import json
+import pickle
+from functools import partial
 import queue
-from multiprocessing import Process, Manager
-from typing import Optional
+import selectors
+from multiprocessing import Array, Event, Lock, Process, Queue
+from multiprocessing.sharedctypes import RawArray, RawValue
+from typing import Any, List, NamedTuple, Optional, Union
 import os
+import io
 import requests
+from picamera2 import Picamera2
+from requests.adapters import HTTPAdapter
 from communication.android import AndroidLink, AndroidMessage
 from communication.stm32 import STMLink
+from command_ring import CommandRing
 from consts import SYMBOL_MAP
 from logger import prepare_logger
 from settings import API_IP, API_PORT
 
-
-class PiAction:
+# CPU core of each process on the Pi's 4 cores, so that they are not migrated between cores
+MAIN_CORE = 0
+STM_CORE = 1
+ACTION_CORE = 2
+ANDROID_CORE = 3
+# Real-time priority of the link receiver, which releases the movement lock on every ACK
+STM_PRIORITY = 50
+# Two-character prefixes of the commands that are sent straight to STM32
+STM_PREFIXES = frozenset(("FW", "BW", "FL", "FR", "BL", "BR", "SS"))
+# Same text as json.dumps of the location dict, without building the dict on every ACK
+LOC_FMT = '{"x": %d, "y": %d, "d": %d}'
+LOCATION_MESSAGE = partial(AndroidMessage, "location")
+
+# Messages that never change, AndroidMessage is read-only so they can be queued again and again
+CONNECTED_MSG = AndroidMessage("info", "Connected to the RPi!")
+READY_MSG = AndroidMessage("info", "Robot is ready!")
+RECONNECTED_MSG = AndroidMessage("info", "You are reconnected!")
+STARTING_MSG = AndroidMessage("info", "Starting robot!")
+EMPTY_OBSTACLES_MSG = AndroidMessage("error", "Empty obstacles")
+REQUESTING_ALGO_MSG = AndroidMessage("info", "Requesting from algo...")
+
+
+class PiAction(NamedTuple):
     """
     Class that represents an action that the RPi needs to take.
+    A tuple, so that it pickles small onto the action queue.
+    :param cat: The category of the action. Can be 'info', 'mode', 'path', 'snap', 'obstacle', 'location', 'failed', 'success'
+    :param value: The value of the action. Can be a string, a list of coordinates, or a list of obstacles.
+    """
+
+    cat: str
+    value: Any
+
+
+class SharedSnapshot:
+    """
+    A picklable value that one process publishes into shared memory, and other processes read whole.
+    Reading costs one copy and one unpickle, rather than a Manager round trip for every item.
     """
 
-    def __init__(self, cat, value):
+    def __init__(self, value: Any = None, size: int = 4096):
         """
-        :param cat: The category of the action. Can be 'info', 'mode', 'path', 'snap', 'obstacle', 'location', 'failed', 'success'
-        :param value: The value of the action. Can be a string, a list of coordinates, or a list of obstacles.
+        :param value: The value to publish first.
+        :param size: The largest pickled value the snapshot can hold, in bytes.
         """
-        self._cat = cat
-        self._value = value
-
-    @property
-    def cat(self):
-        return self._cat
+        self._lock = Lock()
+        self._length = RawValue("I", 0)
+        self._buffer = RawArray("c", size)
+        self.publish(value)
 
-    @property
-    def value(self):
-        return self._value
+    def publish(self, value: Any) -> None:
+        """
+        Replaces the published value
+        :param value: The new value.
+        """
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > len(self._buffer):
+            raise ValueError(f"Snapshot of {len(data)} bytes does not fit in {len(self._buffer)} bytes")
+        with self._lock:
+            self._buffer[:len(data)] = data
+            self._length.value = len(data)
+
+    def load(self) -> Any:
+        """
+        :return: A copy of the published value.
+        """
+        with self._lock:
+            data = self._buffer[:self._length.value]
+        return pickle.loads(data)
 
 
 class RaspberryPi:
@@ -45,73 +101,109 @@ class RaspberryPi:
         Initializes the Raspberry Pi.
         """
         self.logger = prepare_logger()
-        # self.android_link = AndroidLink()
+        # Neither link opens anything until connect() is called in start()
         self.stm_link = STMLink()
         self.android_link = AndroidLink()
-        self.manager = Manager()
+        # Semaphore based, inherited by the forked children instead of going through a Manager
+        self.android_dropped = Event()
+        self.start_movement = Event()
 
-        self.android_dropped = self.manager.Event()
-        self.start_movement = self.manager.Event()
-
-        self.movement_lock = self.manager.Lock()
+        # A POSIX semaphore with a maximum of one, released by a different process than the one that acquired it.
+        # Unlike Semaphore(1), an unmatched release raises instead of letting two movements through
+        self.movement_lock = Lock()
 
+        # Queues are shared through pipes rather than a Manager process, the children are forked from here
         # Messages to send to Android
-        self.android_queue = self.manager.Queue()
+        self.android_queue = Queue()
         # Messages that need to be processed by RPi
-        self.action_queue = self.manager.Queue()
+        self.action_queue = Queue()
         # Messages that need to be processed by STM32, as well as snap commands
-        self.command_queue = self.manager.Queue()
+        self.command_queue = CommandRing(capacity=1024, item_size=16)
         # X,Y,D coordinates of the robot after execution of a command
-        self.path_queue = self.manager.Queue()
+        self.path_queue = Queue()
 
-        self.proc_recv_android: Optional[Process] = None
-        self.proc_recv_stm32: Optional[Process] = None
+        self.proc_recv_links: Optional[Process] = None
         self.proc_android_sender: Optional[Process] = None
         self.proc_rpi_action: Optional[Process] = None
         self.proc_command_follower: Optional[Process] = None
 
-        self.success_obstacles = self.manager.list()
-        self.failed_obstacles = self.manager.list()
-        self.obstacles = self.manager.dict()
-        self.current_location = self.manager.dict()
+        # Lists of obstacle dicts, in place of the Manager lists they replace. Nothing records into them yet,
+        # a process that does should publish its whole list after each change
+        self.success_obstacles = SharedSnapshot([])
+        self.failed_obstacles = SharedSnapshot([])
+        # Only stored and read inside rpi_action (snap_and_rec runs there too), so each process keeps its own copy
+        self.obstacles = {}
+        # X, Y, D of the robot, the whole location is written at once under the array's lock
+        self.current_location = Array("i", 3)
         self.failed_attempt = False
 
+        # Created lazily inside the process that uses it, see `http`
+        self._http: Optional[requests.Session] = None
+        self._http_pid: Optional[int] = None
+        # command_follower picks the handler of a command from its first two characters
+        self.command_handlers = {prefix: self.send_stm_command for prefix in STM_PREFIXES}
+        self.command_handlers["SN"] = self.queue_snap
+
+        # Created inside the process that snaps images, see `open_camera`
+        self._camera: Optional[Picamera2] = None
+        # Created inside the link receiver process, see `recv_links`
+        self.link_selector: Optional[selectors.BaseSelector] = None
+
     def start(self):
         """Starts the RPi orchestrator"""
         try:
             ### Start up initialization ###
 
-            self.android_queue.put(AndroidMessage("info", "Connected to the RPi!"))
+            self.android_queue.put(CONNECTED_MSG)
             self.stm_link.connect()
             self.check_api()
 
             # Define child processes
             self.proc_command_follower = Process(target=self.command_follower)
             self.proc_rpi_action = Process(target=self.rpi_action)
-            self.proc_recv_stm32 = Process(target=self.recv_stm)
 
             # Start child processes
+            os.sched_setaffinity(0, {MAIN_CORE})
             self.proc_command_follower.start()
             self.proc_rpi_action.start()
-            self.proc_recv_stm32.start()
+            self.pin_process(self.proc_command_follower, ACTION_CORE)
+            self.pin_process(self.proc_rpi_action, ACTION_CORE)
 
             self.logger.info("Child Processes spawned")
 
+            # Movement only starts on the Android start command, so both links are received once it is connected
             self.android_link.connect()
             self.proc_android_sender = Process(target=self.android_sender)
             self.proc_android_sender.start()
-            self.proc_recv_android = Process(target=self.recv_android)
-            self.proc_recv_android.start()
+            self.proc_recv_links = Process(target=self.recv_links)
+            self.proc_recv_links.start()
+            self.pin_process(self.proc_android_sender, ANDROID_CORE)
+            self.pin_process(self.proc_recv_links, STM_CORE, priority=STM_PRIORITY)
 
             ### Start up complete ###
 
             # Send success message to Android
-            self.android_queue.put(AndroidMessage("info", "Robot is ready!"))
+            self.android_queue.put(READY_MSG)
             # self.reconnect_android()
 
         except KeyboardInterrupt:
             self.stop()
 
+    def pin_process(self, proc: Process, core: int, priority: Optional[int] = None) -> None:
+        """
+        Pins a started child process to a CPU core, and optionally gives it a real-time priority
+        :param proc: the started child process
+        :param core: the CPU core to run on
+        :param priority: SCHED_FIFO priority, or None to keep the default scheduler
+        """
+        os.sched_setaffinity(proc.pid, {core})
+        if priority is None:
+            return
+        try:
+            os.sched_setscheduler(proc.pid, os.SCHED_FIFO, os.sched_param(priority))
+        except PermissionError:
+            self.logger.warning(f"No permission to set real-time priority of process {proc.pid}")
+
     def reconnect_android(self):
         """Handles the reconnection to Android in the event of a lost connection."""
         while True:
@@ -127,10 +219,10 @@ class RaspberryPi:
             if self.proc_android_sender:
                 self.proc_android_sender.join()
 
-            if self.proc_recv_android:
-                self.proc_recv_android.kill()
-            if self.proc_recv_android:
-                self.proc_recv_android.join()
+            if self.proc_recv_links:
+                self.proc_recv_links.kill()
+            if self.proc_recv_links:
+                self.proc_recv_links.join()
             self.logger.debug("Android child processes killed")
 
             # Clean up old sockets
@@ -138,14 +230,16 @@ class RaspberryPi:
             self.android_link.connect()
 
             # Recreate Android processes
-            self.proc_recv_android = Process(target=self.recv_android)
+            self.proc_recv_links = Process(target=self.recv_links)
             self.proc_android_sender = Process(target=self.android_sender)
 
             # Start previously killed processes
-            self.proc_recv_android.start()
+            self.proc_recv_links.start()
             self.proc_android_sender.start()
+            self.pin_process(self.proc_recv_links, STM_CORE, priority=STM_PRIORITY)
+            self.pin_process(self.proc_android_sender, ANDROID_CORE)
 
-            self.android_queue.put(AndroidMessage("info", "You are reconnected!"))
+            self.android_queue.put(RECONNECTED_MSG)
             self.android_dropped.clear()
 
     def android_sender(self) -> None:
@@ -155,59 +249,76 @@ class RaspberryPi:
         while True:
             # Retrieve from queue
             try:
-                message: AndroidMessage = self.android_queue.get(timeout=0.5)
+                message: Union[AndroidMessage, List[AndroidMessage]] = self.android_queue.get(timeout=0.5)
             except queue.Empty:
                 continue
             try:
-                self.android_link.send(message)
+                # Location updates from a burst of ACKs arrive as one list
+                if isinstance(message, list):
+                    self.android_link.send_batch(message)
+                else:
+                    self.android_link.send(message)
             except OSError:
                 self.android_dropped.set()
                 self.logger.debug("Error Event triggered: Android dropped")
 
-    def recv_android(self) -> None:
+    def recv_links(self) -> None:
         """
-        [Child Process] Processes the messages received from Android
+        [Child Process] Waits on both the STM32 and the Android link, and handles whichever one has data
         """
+        self.link_selector = selectors.DefaultSelector()
+        self.link_selector.register(self.stm_link.fileno(), selectors.EVENT_READ, self.recv_stm)
+        self.link_selector.register(self.android_link.fileno(), selectors.EVENT_READ, self.recv_android)
         while True:
-            msg_str: Optional[str] = None
-            try:
-                msg_str = self.android_link.recv()
-            except OSError:
-                self.android_dropped.set()
-                self.logger.debug("Event set: Android connection dropped")
+            for key, _ in self.link_selector.select():
+                key.data(key.fd)
 
-            if msg_str is None:
-                continue
+    def recv_android(self, fd: int) -> None:
+        """
+        Processes a message received from Android
+        :param fd: the file descriptor of the Android link
+        """
+        msg_str = self.android_link.recv()
+        # recv returns an empty string once the connection is broken
+        if not msg_str:
+            self.link_selector.unregister(fd)
+            self.android_dropped.set()
+            self.logger.debug("Event set: Android connection dropped")
+            return
 
-            try:
-                message: dict = json.loads(msg_str)
-            except:
-                return
-
-            self.logger.debug(f"Receive msg: {message}")
-            ## Command: Set obstacles ##
-            if message["cat"] == "obstacles":
-                self.action_queue.put(PiAction(**message))
-                self.logger.debug(f"Set obstacles PiAction added to queue: {message}")
-
-            ## Command: Start Moving ##
-            if message == "START":
-                # Commencing path following
-                if not self.command_queue.empty():
-                    # Main trigger to start movement #
-                    self.start_movement.set()
-                    self.android_queue.put(AndroidMessage("info", "Starting robot!"))
-                else:
-                    self.logger.warning("Empty obstacles")
-                    self.android_queue.put(AndroidMessage("error", "Empty obstacles"))
+        ## Command: Start Moving ##
+        # Sent as a bare string, which is not JSON, so it is matched before parsing
+        if msg_str == "START":
+            # Commencing path following
+            if not self.command_queue.empty():
+                # Main trigger to start movement #
+                self.start_movement.set()
+                self.android_queue.put(STARTING_MSG)
+            else:
+                self.logger.warning("Empty obstacles")
+                self.android_queue.put(EMPTY_OBSTACLES_MSG)
+            return
+
+        try:
+            message = json.loads(msg_str)
+        except json.JSONDecodeError:
+            self.logger.warning(f"Ignored invalid message from Android: {msg_str}")
+            return
+
+        self.logger.debug("Receive msg: %s", message)
+        ## Command: Set obstacles ##
+        if isinstance(message, dict) and message.get("cat") == "obstacles":
+            self.action_queue.put(PiAction(**message))
+            self.logger.debug("Set obstacles PiAction added to queue: %s", message)
 
     def rpi_action(self):
         # return
+        self.open_camera()
         while True:
             self.start_movement.wait()
             action: PiAction = self.action_queue.get()
             self.logger.debug(
-                f"PiAction retrieved from queue: {action.cat} {action.value}"
+                "PiAction retrieved from queue: %s %s", action.cat, action.value
             )
             if action.cat == "obstacles":
                 for obs in action.value["obstacles"]:
@@ -223,16 +334,15 @@ class RaspberryPi:
         self.stm_link.disconnect()
         self.logger.info("Program exited!")
 
-    def recv_stm(self) -> None:
+    def recv_stm(self, fd: int) -> None:
         """
-        [Child Process] Receive acknowledgement messages from STM32, and release the movement lock
+        Receive acknowledgement messages from STM32, and release the movement lock
+        :param fd: the file descriptor of the STM32 link
         """
-        while True:
-            message = self.stm_link.recv()
-            if message == None:
-                raise Exception("Invalid message")
-
-            self.logger.info(f"STM Callback message {message}")
+        # Every message already waiting is handled together, so a burst of ACKs costs one put
+        locations: List[AndroidMessage] = []
+        for message in self.stm_link.recv_many():
+            self.logger.info("STM Callback message %s", message)
 
             if message == "ACK":
                 self.movement_lock.release()
@@ -240,24 +350,15 @@ class RaspberryPi:
 
                 cur_location = self.path_queue.get_nowait()
 
-                self.current_location["x"] = cur_location["x"]
-                self.current_location["y"] = cur_location["y"]
-                self.current_location["d"] = cur_location["d"]
-                self.logger.info(f"self.current_location = {self.current_location}")
-                self.android_queue.put(
-                    AndroidMessage(
-                        "location",
-                        json.dumps(
-                            {
-                                "x": cur_location["x"],
-                                "y": cur_location["y"],
-                                "d": cur_location["d"],
-                            }
-                        ),
-                    )
-                )
+                loc = (cur_location["x"], cur_location["y"], cur_location["d"])
+                self.current_location[:] = loc
+                self.logger.info("self.current_location = %s", cur_location)
+                locations.append(LOCATION_MESSAGE(LOC_FMT % loc))
             else:
-                self.logger.warning(f"Ignored unknown message from STM: {message}")
+                self.logger.warning("Ignored unknown message from STM: %s", message)
+
+        if locations:
+            self.android_queue.put(locations)
 
     def command_follower(self) -> None:
         """
@@ -269,63 +370,106 @@ class RaspberryPi:
             # Wait for android start command [Main Trigger]
             self.start_movement.wait()
 
-            # STM32 Commands - Send straight to STM32
-            stm32_prefixes = ("FW", "BW", "FL", "FR", "BL", "BR", "SS")
-            if command.startswith(stm32_prefixes):
-                self.movement_lock.acquire(blocking=True)
-                self.stm_link.send(command)
-                self.logger.debug(f"Sending movement command to STM32: {command}")
-
-            # Snap command
-            elif command.startswith("SNAP"):
-                obstacle_id_with_signal = command.replace("SNAP", "")
-                self.action_queue.put(
-                    PiAction(cat="snap", value=obstacle_id_with_signal)
-                )
-
-            # End of path
+            handler = self.command_handlers.get(command[:2])
+            if handler is not None:
+                handler(command)
+            # End of path, "SSSSS" only gets here if "SS" is not sent straight to STM32
             elif command == "SSSSS":
-                self.logger.info(
-                    f"At FIN, self.failed_obstacles: {self.failed_obstacles}"
-                )
-                self.logger.info(
-                    f"At FIN, self.current_location: {self.current_location}"
-                )
-                if len(self.failed_obstacles) != 0 and self.failed_attempt == False:
-                    # NOTE: retrying
-                    new_obstacle_list = list(self.failed_obstacles)
-                    for obj in list(self.success_obstacles):
-                        # example: {'x': 5, 'y': 11, 'id': 1, 'd': 4}
-                        obj["d"] = 8
-                        new_obstacle_list.append(obj)
-
-                    self.logger.info("Attempting to go to failed obstacles")
-                    self.failed_attempt = True
-                    self.request_algo(
-                        {"obstacles": new_obstacle_list},
-                        self.current_location["x"],
-                        self.current_location["y"],
-                        self.current_location["d"],
-                        retrying=True,
-                    )
-                    self.movement_lock.release()
-                    continue
-
-                self.start_movement.clear()
-                self.movement_lock.release()
-                self.logger.info("Commands queue finished.")
-                # self.android_queue.put(AndroidMessage(
-                #     "info", "Commands queue finished."))
-                # self.android_queue.put(AndroidMessage("status", "finished"))
-                # self.action_queue.put(PiAction(cat="stitch", value=""))
+                self.finish_path()
             else:
                 raise Exception(f"Unknown command: {command}")
 
-    def capture_image(self, filename: str):
-        os.system(
-            f"libcamera-still -e jpg -n -t 500 -o {filename} --awb auto > /dev/null 2>&1"
+    def send_stm_command(self, command: str) -> None:
+        """
+        STM32 Commands - Send straight to STM32
+        :param command: the movement command
+        """
+        self.movement_lock.acquire(blocking=True)
+        self.stm_link.send(command)
+        self.logger.debug("Sending movement command to STM32: %s", command)
+
+    def queue_snap(self, command: str) -> None:
+        """
+        Snap command - Queue the image capture for rpi_action
+        :param command: SNAP followed by the obstacle ID, an underscore, and the signal
+        """
+        # Keep the robot still until the image is captured, released in snap_and_rec
+        self.movement_lock.acquire(blocking=True)
+        obstacle_id_with_signal = command.replace("SNAP", "")
+        self.action_queue.put(
+            PiAction(cat="snap", value=obstacle_id_with_signal)
         )
 
+    def finish_path(self) -> None:
+        """
+        End of path - Retry the failed obstacles once, otherwise stop following commands
+        """
+        failed_obstacles = self.failed_obstacles.load()
+        self.logger.info(
+            "At FIN, self.failed_obstacles: %s", failed_obstacles
+        )
+        robot_x, robot_y, robot_dir = self.current_location[:]
+        self.logger.info(
+            "At FIN, self.current_location: (%s, %s, %s)", robot_x, robot_y, robot_dir
+        )
+        if len(failed_obstacles) != 0 and self.failed_attempt == False:
+            # NOTE: retrying
+            new_obstacle_list = failed_obstacles
+            for obj in self.success_obstacles.load():
+                # example: {'x': 5, 'y': 11, 'id': 1, 'd': 4}
+                obj["d"] = 8
+                new_obstacle_list.append(obj)
+
+            self.logger.info("Attempting to go to failed obstacles")
+            self.failed_attempt = True
+            self.request_algo(
+                {"obstacles": new_obstacle_list},
+                robot_x,
+                robot_y,
+                robot_dir,
+                retrying=True,
+            )
+            self.movement_lock.release()
+            return
+
+        self.start_movement.clear()
+        self.movement_lock.release()
+        self.logger.info("Commands queue finished.")
+        # self.android_queue.put(AndroidMessage(
+        #     "info", "Commands queue finished."))
+        # self.android_queue.put(AndroidMessage("status", "finished"))
+        # self.action_queue.put(PiAction(cat="stitch", value=""))
+
+    @property
+    def http(self) -> requests.Session:
+        """
+        Returns the HTTP session used to talk to the API, so that connections are kept alive between requests.
+        Sessions are not fork-safe, so each process creates its own on first use.
+        """
+        if self._http is None or self._http_pid != os.getpid():
+            self._http = requests.Session()
+            self._http.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+            self._http_pid = os.getpid()
+        return self._http
+
+    def open_camera(self):
+        """
+        Starts the camera once for the process, so that a snap only has to grab a frame.
+        Auto white balance is the default, as with `libcamera-still --awb auto`.
+        """
+        self._camera = Picamera2()
+        self._camera.configure(self._camera.create_still_configuration())
+        self._camera.start()
+
+    def capture_image(self) -> bytes:
+        """
+        Captures a JPEG image into memory, so that it can be uploaded without going through the SD card
+        :return: the JPEG bytes
+        """
+        buffer = io.BytesIO()
+        self._camera.capture_file(buffer, format="jpeg")
+        return buffer.getvalue()
+
     def snap_and_rec(self, obstacle_id_with_signal: str) -> None:
         """
         RPi snaps an image and calls the API for image-rec.
@@ -333,12 +477,20 @@ class RaspberryPi:
         :param obstacle_id_with_signal: the current obstacle ID followed by underscore followed by signal
         """
         obstacle_id, signal = obstacle_id_with_signal.split("_")
-        self.logger.info(f"Capturing image for obstacle id: {obstacle_id}")
+        self.logger.info("Capturing image for obstacle id: %s", obstacle_id)
         filename = f"{obstacle_id}_{signal}.jpg"
-        self.capture_image(filename)
+        try:
+            image = self.capture_image()
+        finally:
+            # release lock so that bot can continue moving while the image is recognised
+            self.movement_lock.release()
 
         url = f"http://{API_IP}:{API_PORT}/image"
-        response = requests.post(url, files={"file": (filename, open(filename, "rb"))})
+        try:
+            response = self.http.post(url, files={"file": (filename, image, "image/jpeg")})
+        except requests.RequestException as e:
+            self.logger.error(f"Image-rec request failed: {e}")
+            return
 
         if response.status_code != 200:
             self.logger.error(
@@ -348,14 +500,11 @@ class RaspberryPi:
 
         results = response.json()
 
-        # release lock so that bot can continue moving
-        self.movement_lock.release()
-
-        self.logger.info(f"results: {results}")
-        self.logger.info(f"Detected image id: {results['image_id']}")
-        self.logger.info(f"self.obstacles: {self.obstacles}")
+        self.logger.info("results: %s", results)
+        self.logger.info("Detected image id: %s", results['image_id'])
+        self.logger.info("self.obstacles: %s", self.obstacles)
         self.logger.info(
-            f"Image recognition results: {results} ({SYMBOL_MAP.get(results['image_id'])})"
+            "Image recognition results: %s (%s)", results, SYMBOL_MAP.get(results['image_id'])
         )
 
         self.android_queue.put(
@@ -373,7 +522,7 @@ class RaspberryPi:
         The received commands and path are then queued in the respective queues
         """
         self.logger.info("Requesting path from algo...")
-        self.android_queue.put(AndroidMessage("info", "Requesting from algo..."))
+        self.android_queue.put(REQUESTING_ALGO_MSG)
         self.logger.info(f"data: {data}")
 
         body = {
@@ -395,7 +544,7 @@ class RaspberryPi:
         #     "retrying": retrying,
         # }
         url = f"http://{API_IP}:{API_PORT}/path"
-        response = requests.post(url, json=body)
+        response = self.http.post(url, json=body)
 
         # Error encountered at the server, return early
         if response.status_code != 200:
@@ -408,7 +557,7 @@ class RaspberryPi:
         path = result["path"]
 
         # Log commands received
-        self.logger.debug(f"Commands received from API: {commands}")
+        self.logger.debug("Commands received from API: %s", commands)
 
         # Put commands and paths into respective queues
         self.clear_queues()
@@ -422,7 +571,7 @@ class RaspberryPi:
     def request_stitch(self):
         """Sends a stitch request to the image recognition API to stitch the different images together"""
         url = f"http://{API_IP}:{API_PORT}/stitch"
-        response = requests.get(url)
+        response = self.http.get(url)
 
         # If error, then log, and send error to Android
         if response.status_code != 200:
@@ -434,17 +583,19 @@ class RaspberryPi:
 
     def clear_queues(self):
         """Clear both command and path queues"""
-        while not self.command_queue.empty():
-            self.command_queue.get()
-        while not self.path_queue.empty():
-            self.path_queue.get()
+        self.command_queue.reset()
+        while True:
+            try:
+                self.path_queue.get_nowait()
+            except queue.Empty:
+                break
 
     def check_api(self) -> bool:
         """Check whether image recognition and algorithm API server is up and running"""
         # Check image recognition API
         url = f"http://{API_IP}:{API_PORT}/status"
         try:
-            response = requests.get(url, timeout=1)
+            response = self.http.get(url, timeout=1)
             if response.status_code == 200:
                 self.logger.debug("API is up!")
                 return True
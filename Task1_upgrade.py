@@ -4,7 +4,7 @@ import json
 import queue
 from multiprocessing import Process, Manager, Semaphore
 import time
-from typing import Optional
+from typing import Any, NamedTuple, Optional
 import os
 import requests
 from communication.android import AndroidLink, AndroidMessage
@@ -14,26 +14,16 @@ from logger import prepare_logger
 from settings import API_IP, API_PORT
 
 
-class PiAction:
+class PiAction(NamedTuple):
     """
     Class that represents an action that the RPi needs to take.
+    A tuple, so that it pickles small onto the action queue.
+    :param cat: The category of the action. Can be 'info', 'mode', 'path', 'snap', 'obstacle', 'location', 'failed', 'success'
+    :param value: The value of the action. Can be a string, a list of coordinates, or a list of obstacles.
     """
 
-    def __init__(self, cat, value):
-        """
-        :param cat: The category of the action. Can be 'info', 'mode', 'path', 'snap', 'obstacle', 'location', 'failed', 'success'
-        :param value: The value of the action. Can be a string, a list of coordinates, or a list of obstacles.
-        """
-        self._cat = cat
-        self._value = value
-
-    @property
-    def cat(self):
-        return self._cat
-
-    @property
-    def value(self):
-        return self._value
+    cat: str
+    value: Any
 
 
 class RaspberryPi:
@@ -73,8 +63,8 @@ class RaspberryPi:
         self.proc_rpi_action = None
         self.proc_command_follower = None
 
-        self.success_obstacles = self.manager.list()
-        self.obstacles = self.manager.dict()
+        # Filled and read by rpi_action only, which also runs snap_and_rec, so it does not need to be shared
+        self.obstacles = {}
 
     def start(self):
         """Starts the RPi orchestrator"""
@@ -311,7 +301,8 @@ class RaspberryPi:
 
         self.logger.info(f"results: {results}")
         self.logger.info(f"Detected image id: {results['image_id']}")
-        self.logger.info(f"self.obstacles: {self.obstacles}")
+        # Only the snapped obstacle, rather than formatting every obstacle after each snap
+        self.logger.debug("Obstacle: %s", self.obstacles.get(int(obstacle_id)))
         self.logger.info(
             f"Image recognition results: {results} ({SYMBOL_MAP.get(results['image_id'])})"
         )
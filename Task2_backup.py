@@ -1,18 +1,57 @@
 # _!/venv/bin/python
 
+import io
 import json
-import queue
-from multiprocessing import Process, Manager, Semaphore
+from multiprocessing import Event, Lock, Pipe, Process, Semaphore
+from multiprocessing.sharedctypes import RawArray, RawValue
+import threading
 import time
-from typing import Optional
+from typing import List, Optional
 import os
-import requests
+import urllib3
+from picamera2 import Picamera2
 from communication.android import AndroidLink, AndroidMessage
 from communication.stm32 import STMLink
+from command_ring import JoinableCommandRing
 from consts import SYMBOL_MAP
 from logger import prepare_logger
 from settings import API_IP, API_PORT
 
+# CPU core of each process on the Pi's 4 cores, so that they are not migrated between cores
+MAIN_CORE = 0  # main process and android_sender
+STM_CORE = 1  # recv_stm and command_follower, which hand lock_stm back and forth
+ANDROID_CORE = 2  # recv_android, which also snaps the images
+CAMERA_CORE = 3  # libcamera's threads inside recv_android, moved there by open_camera
+
+# Two-character prefixes of the commands that are sent straight to STM32
+STM_PREFIXES = frozenset(("FW", "BW", "FL", "FR", "BL", "BR", "SS"))
+
+# Messages that never change, AndroidMessage is read-only so they can be queued again and again
+CONNECTED_MSG = AndroidMessage("info", "Connected to the RPi!")
+READY_MSG = AndroidMessage("info", "Robot is ready!")
+RECONNECTED_MSG = AndroidMessage("info", "You are reconnected!")
+STARTING_MSG = AndroidMessage("info", "Starting robot!")
+
+# Image ids of the arrows, as returned by the image-rec API
+LEFT_ARROW = "39"
+RIGHT_ARROW = "38"
+
+# Commands after the first snap: around the first obstacle, then up to the second one.
+# Looked up by the image id, anything but a left arrow goes right.
+TASK2_AFTER_IMAGE_1 = {
+    LEFT_ARROW: ("FL000", "FR000", "FW030", "FR000", "FL000", "FW150"),
+}
+TASK2_AFTER_IMAGE_1_DEFAULT = ("FR000", "FL000", "FW030", "FL000", "FR000", "FW150")
+
+# Commands after the second snap: around the second obstacle, back past the first one, and into the car park
+_AROUND_LEFT = ("FL000", "FW050", "FR000", "FW040", "FR000", "FW120", "FR000", "FW240")
+_AROUND_RIGHT = ("FR000", "FW050", "FL000", "FW040", "FR000", "FW120", "FR000", "FW240")
+TASK2_AFTER_IMAGE_2 = {
+    LEFT_ARROW: _AROUND_LEFT + ("FR000", "FW030", "FL000", "FW060", "SSSSS"),
+    RIGHT_ARROW: _AROUND_RIGHT + ("FL000", "FW030", "FR000", "FW060", "SSSSS"),
+}
+TASK2_AFTER_IMAGE_2_DEFAULT = _AROUND_RIGHT + ("FR000", "FW030", "FL000", "FW060", "SSSSS")
+
 
 class PiAction:
     """
@@ -36,6 +75,40 @@ class PiAction:
         return self._value
 
 
+class MessagePipe:
+    """
+    Queue of messages for a single reader, over a one-way pipe.
+    The reader sleeps in the kernel until a message is written, and holds no lock while doing so,
+    so it can be killed and restarted without leaving the pipe locked.
+    A writer must not be killed: it could die holding the write lock, or with half a message written.
+    """
+
+    def __init__(self):
+        self._reader, self._writer = Pipe(duplex=False)
+        # Several processes write, each message must reach the pipe whole
+        self._write_lock = Lock()
+
+    def put(self, message) -> None:
+        """
+        :param message: The picklable message to send.
+        """
+        with self._write_lock:
+            self._writer.send(message)
+
+    def get(self):
+        """
+        Blocks until a message is available
+        :return: The oldest message.
+        """
+        return self._reader.recv()
+
+    def poll(self) -> bool:
+        """
+        :return: True if a message can be read without blocking.
+        """
+        return self._reader.poll()
+
+
 class RaspberryPi:
     """
     Class that represents the Raspberry Pi.
@@ -49,53 +122,71 @@ class RaspberryPi:
         self.stm_link = STMLink()
         self.android_link = AndroidLink()
 
-        self.manager = Manager()
-
-        self.android_dropped = self.manager.Event()
-        self.start_movement = self.manager.Event()
+        # Semaphore based and inherited on fork, so waiting on them does not go through a server process
+        self.android_dropped = Event()
+        self.start_movement = Event()
         self.lock_stm = Semaphore(1)
         self.lock_stm.acquire()
 
-        # Messages to send to Android
-        self.android_queue = self.manager.Queue()
-        # Messages that need to be processed by RPi
-        # Messages that need to be processed by STM32, as well as snap commands
-        self.command_queue = self.manager.Queue()
-        self.dists = self.manager.list()
+        # Messages to send to Android, put by several processes and read by android_sender
+        self.android_queue = MessagePipe()
+        # Messages that need to be processed by STM32, only put by recv_android and read by command_follower
+        self.command_queue = JoinableCommandRing(capacity=64, item_size=8)
+        # Distances reported in the STM32 ACKs, only appended to by recv_stm, `dists_count` of them are valid
+        self.dists = RawArray("i", 64)
+        self.dists_count = RawValue("i", 0)
 
         self.proc_recv_android: Optional[Process] = None
         self.proc_recv_stm32: Optional[Process] = None
         self.proc_android_sender: Optional[Process] = None
         self.proc_command_follower: Optional[Process] = None
 
+        # Created lazily inside the child process that uses it, see `http`
+        self._http: Optional[urllib3.PoolManager] = None
+        self._http_pid: Optional[int] = None
+        # Created inside the process that snaps images, see `open_camera`
+        self._camera: Optional[Picamera2] = None
+
     def start(self):
         """Starts the RPi orchestrator"""
         try:
             ### Start up initialization ###
             self.stm_link.connect()
             self.android_link.connect()
-            self.android_queue.put(AndroidMessage("info", "Connected to the RPi!"))
+            self.android_queue.put(CONNECTED_MSG)
 
             # Define and start child processes
+            os.sched_setaffinity(0, {MAIN_CORE})
             self.proc_command_follower = Process(target=self.command_follower)
             self.proc_command_follower.start()
+            self.pin_process(self.proc_command_follower, STM_CORE)
             self.proc_recv_stm32 = Process(target=self.recv_stm)
             self.proc_recv_stm32.start()
+            self.pin_process(self.proc_recv_stm32, STM_CORE)
             self.proc_android_sender = Process(target=self.android_sender)
             self.proc_android_sender.start()
             self.proc_recv_android = Process(target=self.recv_android)
             self.proc_recv_android.start()
+            self.pin_process(self.proc_recv_android, ANDROID_CORE)
             self.logger.info("Child Processes spawned")
 
             ### Start up complete ###
 
             # Send success message to Android
-            self.android_queue.put(AndroidMessage("info", "Robot is ready!"))
+            self.android_queue.put(READY_MSG)
             self.reconnect_android()
 
         except KeyboardInterrupt:
             self.stop()
 
+    def pin_process(self, proc: Process, core: int) -> None:
+        """
+        Pins a started child process to a CPU core
+        :param proc: the started child process
+        :param core: the CPU core to run on
+        """
+        os.sched_setaffinity(proc.pid, {core})
+
     def reconnect_android(self):
         """Handles the reconnection to Android in the event of a lost connection."""
         while True:
@@ -104,21 +195,20 @@ class RaspberryPi:
 
             self.logger.error("Android link is down!")
 
-            # Kill child processes
-            self.logger.debug("Killing android child processes")
+            # android_sender only reads android_queue, so it can be killed at any point
+            self.logger.debug("Stopping android child processes")
             if self.proc_android_sender:
                 self.proc_android_sender.kill()
             if self.proc_android_sender:
                 self.proc_android_sender.join()
 
-            if self.proc_recv_android:
-                self.proc_recv_android.kill()
+            # Clean up old sockets. recv_android writes to android_queue and may be killed while holding
+            # its write lock, so it is left to return on its own: the shutdown ends its blocked recv with an empty read
+            self.android_link.disconnect()
             if self.proc_recv_android:
                 self.proc_recv_android.join()
-            self.logger.debug("Android child processes killed")
+            self.logger.debug("Android child processes stopped")
 
-            # Clean up old sockets
-            self.android_link.disconnect()
             self.android_link.connect()
 
             # Recreate Android processes
@@ -128,8 +218,9 @@ class RaspberryPi:
             # Start previously killed processes
             self.proc_recv_android.start()
             self.proc_android_sender.start()
+            self.pin_process(self.proc_recv_android, ANDROID_CORE)
 
-            self.android_queue.put(AndroidMessage("info", "You are reconnected!"))
+            self.android_queue.put(RECONNECTED_MSG)
             self.android_dropped.clear()
 
     def android_sender(self) -> None:
@@ -137,13 +228,15 @@ class RaspberryPi:
         [Child process] Responsible for retrieving messages from android_queue and sending them over the Android link.
         """
         while True:
-            # Retrieve from queue
-            try:
-                message: AndroidMessage = self.android_queue.get(timeout=0.5)
-            except queue.Empty:
-                continue
+            # Sleep until a message arrives, then take every other message already waiting
+            messages: List[AndroidMessage] = [self.android_queue.get()]
+            while self.android_queue.poll():
+                messages.append(self.android_queue.get())
             try:
-                self.android_link.send(message)
+                if len(messages) == 1:
+                    self.android_link.send(messages[0])
+                else:
+                    self.android_link.send_batch(messages)
             except OSError:
                 self.android_dropped.set()
                 self.logger.debug("Error Event triggered: Android dropped")
@@ -152,31 +245,39 @@ class RaspberryPi:
         """
         [Child Process] Processes the messages received from Android
         """
+        # The images are snapped from this process
+        self.open_camera()
+        self.warm_up_api()
         while True:
             msg_str: Optional[str] = None
             try:
                 msg_str = self.android_link.recv()
             except OSError:
+                pass
+
+            # recv returns an empty string once the connection is broken
+            if not msg_str:
                 self.android_dropped.set()
                 self.logger.debug("Event set: Android connection dropped")
-
-            if msg_str is None:
-                continue
+                return
 
             try:
-                message: dict = json.loads(msg_str)
-            except:
-                return
-            self.logger.debug(f"Receive msg: {message}")
+                message = json.loads(msg_str)
+            except json.JSONDecodeError:
+                self.logger.warning("Ignored invalid message from Android: %s", msg_str)
+                continue
+            self.logger.debug("Receive msg: %s", message)
 
             if not (
-                message["cat"] == "control" and message["value"].upper() == "START"
+                isinstance(message, dict)
+                and message.get("cat") == "control"
+                and str(message.get("value")).upper() == "START"
             ):
                 continue
 
             ## Command: Start Moving ##
             # Commencing path following
-            self.android_queue.put(AndroidMessage("info", "Starting robot!"))
+            self.android_queue.put(STARTING_MSG)
 
             time.sleep(1)
             self.start_movement.set()
@@ -187,44 +288,14 @@ class RaspberryPi:
             self.command_queue.join()
             image_1 = self.snap_and_rec("Task2_image_1")
 
-            if int(image_1) == 39:  # Left
-                self.command_queue.put("FL000")
-                self.command_queue.put("FR000")
-                self.command_queue.put("FW030")
-                self.command_queue.put("FR000")
-                self.command_queue.put("FL000")
-            else:
-                self.command_queue.put("FR000")
-                self.command_queue.put("FL000")
-                self.command_queue.put("FW030")
-                self.command_queue.put("FL000")
-                self.command_queue.put("FR000")
-
             # NOTE: cache self.dists[2]
-            self.command_queue.put("FW150")
+            self.command_queue.put_many(TASK2_AFTER_IMAGE_1.get(str(image_1), TASK2_AFTER_IMAGE_1_DEFAULT))
 
             # BLock until completes
             self.command_queue.join()
             image_2 = self.snap_and_rec("Task2_image_2")
 
-            if int(image_2) == 39:  # Left
-                self.command_queue.put("FL000")
-                self.command_queue.put("FW050")
-                self.command_queue.put("FR000")
-                self.command_queue.put("FW040")
-                self.command_queue.put("FR000")
-                self.command_queue.put("FW120")
-                self.command_queue.put("FR000")
-
-            else:  # Right
-                self.command_queue.put("FR000")
-                self.command_queue.put("FW050")
-                self.command_queue.put("FL000")
-                self.command_queue.put("FW040")
-                self.command_queue.put("FR000")
-                self.command_queue.put("FW120")
-                self.command_queue.put("FR000")
-
+            # The FW240 on the way back used to be computed from the distances:
             # backward = int(self.dists[0] + self.dists[1]) * 10 + 60
             #
             # CMD_BACK = f"FW{f'{backward}' if backward >= 100 else f'0{backward}'}"
@@ -233,19 +304,7 @@ class RaspberryPi:
             # )
             #
             # self.command_queue.put(CMD_BACK)
-            self.command_queue.put("FW240")
-
-            if int(image_2) == 38:  # right
-                self.command_queue.put("FL000")
-                self.command_queue.put("FW030")
-                self.command_queue.put("FR000")
-            else:
-                self.command_queue.put("FR000")
-                self.command_queue.put("FW030")
-                self.command_queue.put("FL000")
-
-            self.command_queue.put("FW060")
-            self.command_queue.put("SSSSS")  # -10
+            self.command_queue.put_many(TASK2_AFTER_IMAGE_2.get(str(image_2), TASK2_AFTER_IMAGE_2_DEFAULT))
             # self.android_queue.put(AndroidMessage("status", "cooking..."))
 
     def stop(self):
@@ -259,27 +318,33 @@ class RaspberryPi:
         """
         [Child Process] Receive acknowledgement messages from STM32, and release the movement lock
         """
+        # Bound once, they are looked up for every message otherwise
+        recv = self.stm_link.recv
+        release = self.lock_stm.release
+        task_done = self.command_queue.task_done
+        log_info = self.logger.info
         while True:
-            message = self.stm_link.recv()
-            self.logger.warning(f"Message from STM: {message}")
+            message = recv()
             if message == None:
                 raise Exception("Invalid message")
 
-            self.logger.info(f"STM Callback message {message}")
+            log_info("STM Callback message %s", message)
 
             if message.startswith("ACK"):
-                self.lock_stm.release()
-                self.command_queue.task_done()
+                release()
+                task_done()
                 message.strip()
 
                 try:
                     if len(message) == 5:
                         dist = int(message[3:])
-                        self.dists.append(dist)
-                        self.logger.info(f"Got distance args {dist}")
-                        print(dist, "print", self.dists)
+                        count = self.dists_count.value
+                        if count < len(self.dists):
+                            self.dists[count] = dist
+                            self.dists_count.value = count + 1
+                        self.logger.info("Got distance args %s", dist)
                 except:
-                    print("not distance msg", message)
+                    self.logger.debug("Not a distance message: %s", message)
                 finally:
                     self.logger.debug("ACK received, movement lock released.")
 
@@ -287,21 +352,23 @@ class RaspberryPi:
         """
         [Child Process] that execute stm/smap commands
         """
+        # Bound once, they are looked up for every command otherwise
+        get_command = self.command_queue.get
+        acquire = self.lock_stm.acquire
+        send = self.stm_link.send
+        log_debug = self.logger.debug
         while True:
-            if self.lock_stm.get_value() != 1:
-                print("Locked")
-                continue
-
-            self.lock_stm.acquire()
             # Retrieve next movement command
-            command: str = self.command_queue.get()
+            command: str = get_command()
+            # Then sleep until the previous command is ACKed. The command is taken first, so that the
+            # lock is free for snap_and_rec while the queue is empty between two steps
+            acquire()
 
             # STM32 Commands - Send straight to STM32
-            stm32_prefixes = ("FW", "BW", "FL", "FR", "BL", "BR", "SS")
-            if command.startswith(stm32_prefixes):
+            if command[:2] in STM_PREFIXES:
                 time.sleep(3)  # MUST BE DONE
-                self.stm_link.send(command)
-                self.logger.debug(f"Sending movement command to STM32: {command}")
+                send(command)
+                log_debug("Sending movement command to STM32: %s", command)
 
             # End of path
             elif command == "SSSSS":
@@ -310,10 +377,50 @@ class RaspberryPi:
             else:
                 raise Exception(f"Unknown command: {command}")
 
-    def capture_image(self, filename: str):
-        os.system(
-            f"libcamera-still -e jpg -n -t 500 -o {filename} --awb auto > /dev/null 2>&1"
-        )
+    @property
+    def http(self) -> urllib3.PoolManager:
+        """
+        Returns the connection pool used to talk to the API, so that connections are kept alive between requests.
+        Pools are not fork-safe, so each process creates its own on first use.
+        Requests are not retried, as with a plain requests session.
+        """
+        if self._http is None or self._http_pid != os.getpid():
+            self._http = urllib3.PoolManager(num_pools=1, maxsize=4, retries=False)
+            self._http_pid = os.getpid()
+        return self._http
+
+    def warm_up_api(self) -> None:
+        """
+        Opens the pooled connection to the API ahead of time, so that the first snap does not wait on the handshake
+        """
+        try:
+            self.http.request("HEAD", f"http://{API_IP}:{API_PORT}/status", timeout=1)
+        except urllib3.exceptions.HTTPError as e:
+            self.logger.warning("API not reachable yet: %s", e)
+
+    def open_camera(self):
+        """
+        Starts the camera once for the process, so that a snap only has to grab a frame.
+        Auto white balance is the default, as with `libcamera-still --awb auto`.
+        """
+        self._camera = Picamera2()
+        self._camera.configure(self._camera.create_still_configuration())
+        self._camera.start()
+        # Every other thread of this process was started by libcamera, which would otherwise share
+        # this process's core, or the main process's if it started before the process was pinned
+        own_thread = threading.get_native_id()
+        for tid in map(int, os.listdir("/proc/self/task")):
+            if tid != own_thread:
+                os.sched_setaffinity(tid, {CAMERA_CORE})
+
+    def capture_image(self) -> bytes:
+        """
+        Captures a JPEG image into memory, so that it can be uploaded without going through the SD card
+        :return: the JPEG bytes
+        """
+        buffer = io.BytesIO()
+        self._camera.capture_file(buffer, format="jpeg")
+        return buffer.getvalue()
 
     def snap_and_rec(self, obstacle_id: str) -> int | str:
         """
@@ -321,39 +428,31 @@ class RaspberryPi:
         The response is then forwarded back to the android
         :param obstacle_id_with_signal: the current obstacle ID followed by underscore followed by signal
         """
-        while True:
-            if self.lock_stm.get_value() != 1:
-                continue
-            self.lock_stm.acquire()
-            self.logger.info(f"Capturing image for obstacle id: {obstacle_id}")
+        # Sleeps until the robot has stopped, and only holds it still for the capture
+        self.lock_stm.acquire()
+        try:
+            self.logger.info("Capturing image for obstacle id: %s", obstacle_id)
             filename = f"{obstacle_id}.jpg"
-            self.capture_image(filename)
-
-            url = f"http://{API_IP}:{API_PORT}/image"
-            response = requests.post(url, files={"file": (filename, open(filename, "rb"))})
-
-            if response.status_code != 200:
-                self.logger.error("Path from image-rec API dead! Please try again.")
-                self.lock_stm.release()
-                return 0
-
-            results = response.json()
+            image = self.capture_image()
+        finally:
+            # release lock so that any command already queued runs while the image is recognised
             self.lock_stm.release()
 
-            # release lock so that bot can continue moving
-            # self.movement_lock.release()
+        url = f"http://{API_IP}:{API_PORT}/image"
+        response = self.http.request("POST", url, fields={"file": (filename, image, "image/jpeg")})
 
-            self.logger.info(f"Results: {results}")
-            self.logger.info(
-                f"Image recognition results: {results} ({SYMBOL_MAP.get(results['image_id'])})"
-            )
+        if response.status != 200:
+            self.logger.error("Path from image-rec API dead! Please try again.")
+            return 0
 
-            return results["image_id"]
+        results = json.loads(response.data)
+
+        self.logger.info("Results: %s", results)
+        self.logger.info(
+            "Image recognition results: %s (%s)", results, SYMBOL_MAP.get(results["image_id"])
+        )
 
-    def clear_queues(self):
-        """Clear both command and path queues"""
-        while not self.command_queue.empty():
-            self.command_queue.get()
+        return results["image_id"]
 
 
 if __name__ == "__main__":
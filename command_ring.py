@@ -0,0 +1,147 @@
+import os
+from multiprocessing import Lock, Semaphore
+from multiprocessing.sharedctypes import RawArray, RawValue
+from typing import Iterable
+
+
+class CommandRing:
+    """
+    Single-producer single-consumer ring buffer of short commands, kept in shared memory.
+    The capacity is a power of two so that positions wrap with a bitmask.
+    """
+
+    def __init__(self, capacity: int = 1024, item_size: int = 16):
+        """
+        :param capacity: The number of commands the ring can hold. Must be a power of two.
+        :param item_size: The maximum length of a utf-8 encoded command.
+        """
+        if capacity & (capacity - 1):
+            raise ValueError(f"Capacity must be a power of two: {capacity}")
+        self._mask = capacity - 1
+        self._capacity = capacity
+        self._item_size = item_size
+        self._buffer = RawArray("c", capacity * item_size)
+        # Next position to read, only written by the consumer and `reset`, both under `_head_lock`
+        self._head = RawValue("Q", 0)
+        # Next position to write, only written by the producer
+        self._tail = RawValue("Q", 0)
+        # Counts the commands ready to be read, so that the consumer sleeps while the ring is empty.
+        # A reset can leave it ahead of the commands actually in the ring, `get` checks the ring again
+        self._items = Semaphore(0)
+        # Serialises moving the head between the consumer and a reset from another process
+        self._head_lock = Lock()
+
+    def _encode(self, command: str) -> bytes:
+        data = command.encode("utf-8")
+        if len(data) > self._item_size:
+            raise ValueError(f"Command too long for the ring: {command}")
+        return data.ljust(self._item_size, b"\0")
+
+    def put(self, command: str) -> None:
+        """
+        Appends a command, yielding the CPU until the consumer frees a slot if the ring is full
+        :param command: The command to append.
+        """
+        data = self._encode(command)
+        while self._tail.value - self._head.value == self._capacity:
+            os.sched_yield()
+        start = (self._tail.value & self._mask) * self._item_size
+        self._buffer[start:start + self._item_size] = data
+        self._tail.value += 1
+        self._items.release()
+
+    def put_many(self, commands: Iterable[str]) -> None:
+        """
+        Appends several commands, which become visible to the consumer at once
+        :param commands: The commands to append, no more than the capacity of the ring.
+        """
+        encoded = [self._encode(command) for command in commands]
+        while self._capacity - (self._tail.value - self._head.value) < len(encoded):
+            os.sched_yield()
+        tail = self._tail.value
+        for i, data in enumerate(encoded):
+            start = ((tail + i) & self._mask) * self._item_size
+            self._buffer[start:start + self._item_size] = data
+        self._tail.value = tail + len(encoded)
+        for _ in encoded:
+            self._items.release()
+
+    def get(self) -> str:
+        """
+        Removes and returns the oldest command, blocking while the ring is empty
+        :return: The command.
+        """
+        while True:
+            self._items.acquire()
+            with self._head_lock:
+                head = self._head.value
+                # The command this wake-up was for has been dropped by a reset, wait for the next one
+                if head == self._tail.value:
+                    continue
+                start = (head & self._mask) * self._item_size
+                command = self._buffer[start:start + self._item_size].rstrip(b"\0").decode("utf-8")
+                self._head.value = head + 1
+            return command
+
+    def empty(self) -> bool:
+        """
+        :return: True if there is no command to read.
+        """
+        return self._head.value == self._tail.value
+
+    def reset(self) -> None:
+        """
+        Drops every command in the ring at once, it is safe to call while the consumer waits in `get`
+        """
+        with self._head_lock:
+            self._drain_items()
+            self._head.value = self._tail.value
+
+    def _drain_items(self) -> None:
+        # Done before the tail is read, so the wake-up of a command put meanwhile is not drained with the rest
+        while self._items.acquire(block=False):
+            pass
+
+
+class JoinableCommandRing(CommandRing):
+    """
+    A CommandRing where, like a JoinableQueue, `join` waits until every command put so far has been marked done.
+    """
+
+    def __init__(self, capacity: int = 1024, item_size: int = 16):
+        """
+        :param capacity: The number of commands the ring can hold. Must be a power of two.
+        :param item_size: The maximum length of a utf-8 encoded command.
+        """
+        super().__init__(capacity, item_size)
+        # Number of commands marked done or dropped, only written under `_head_lock`
+        self._done = RawValue("Q", 0)
+        # Released on every `task_done`, so that `join` sleeps until the next one
+        self._done_event = Semaphore(0)
+
+    def task_done(self) -> None:
+        """
+        Marks the oldest unfinished command as done.
+        """
+        with self._head_lock:
+            self._done.value += 1
+        self._done_event.release()
+
+    def join(self) -> None:
+        """
+        Blocks until every command put so far has been marked done.
+        """
+        while self._done.value < self._tail.value:
+            self._done_event.acquire()
+
+    def reset(self) -> None:
+        """
+        Drops every command in the ring at once, counting them as done so that `join` does not wait for them
+        """
+        with self._head_lock:
+            self._drain_items()
+            # Read once, a command put after this is neither dropped nor counted as done
+            tail = self._tail.value
+            self._done.value += tail - self._head.value
+            self._head.value = tail
+        self._done_event.release()
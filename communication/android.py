@@ -1,7 +1,7 @@
 import json
 import os
 import socket
-from typing import Any, Optional
+from typing import Any, List, Optional
 import bluetooth
 from communication.link import Link
 
@@ -11,6 +11,9 @@ class AndroidMessage:
     Class for communicating with Android tablet over Bluetooth connection.
     """
 
+    # Messages are created for every location update, and pickled onto the android queue
+    __slots__ = ("_cat", "_value")
+
     def __init__(self, cat: str, value: str):
         """
         Constructor for AndroidMessage.
@@ -162,15 +165,31 @@ class AndroidLink(Link):
         except Exception as e:
             self.logger.error(f"Failed to disconnect Bluetooth link: {e}")
 
+    def fileno(self) -> int:
+        """File descriptor of the connected client socket, so that it can be registered with a selector"""
+        return self.client_sock.fileno()
+
     def send(self, message: AndroidMessage):
         """Send message to Android"""
+        # Encoded once, the log line reuses the same text
+        text = message.jsonify
         try:
-            self.client_sock.send(f"{message.jsonify}\n".encode("utf-8"))
-            self.logger.debug(f"Sent to Android: {message.jsonify}")
+            self.client_sock.send(f"{text}\n".encode("utf-8"))
+            self.logger.debug("Sent to Android: %s", text)
         except OSError as e:
             self.logger.error(f"Error sending message to Android: {e}")
             pass
 
+    def send_batch(self, messages: List[AndroidMessage]):
+        """Send several messages to Android in a single socket write"""
+        texts = [message.jsonify for message in messages]
+        try:
+            self.client_sock.send("".join(f"{text}\n" for text in texts).encode("utf-8"))
+            self.logger.debug("Sent to Android: %s", texts)
+        except OSError as e:
+            self.logger.error(f"Error sending messages to Android: {e}")
+            pass
+
     def recv(self) -> Optional[str]:
         """Receive message from Android"""
         try:
@@ -1,4 +1,6 @@
-from typing import Optional
+import os
+import select
+from typing import List, Optional
 import serial
 from communication.link import Link
 from settings import SERIAL_PORT, BAUD_RATE
@@ -38,10 +40,18 @@ class STMLink(Link):
         """
         super().__init__()
         self.serial_link = None
+        # Bytes read from the serial port that do not make up a complete message yet
+        self.buffer = bytearray()
 
     def connect(self):
         """Connect to STM32 using serial UART connection, given the serial port and the baud rate"""
         self.serial_link = serial.Serial(SERIAL_PORT, BAUD_RATE)
+        # Asks the tty driver to push every received byte up straight away, so 5-byte ACKs are not held back
+        try:
+            self.serial_link.set_low_latency_mode(True)
+        except (AttributeError, ValueError) as e:
+            self.logger.debug(f"Low latency mode not available on the STM32 serial port: {e}")
+        self.buffer.clear()
         self.logger.info("Connected to STM32")
 
     def disconnect(self):
@@ -59,12 +69,48 @@ class STMLink(Link):
         self.serial_link.write(f"{message}".encode("utf-8"))
         self.logger.debug(f"Sent to STM32: {message}")
 
+    def fill_buffer(self) -> None:
+        """Wait for the serial port to be readable, then read everything available into the buffer in one call"""
+        # pyserial opens the port non-blocking
+        fd = self.serial_link.fileno()
+        select.select([fd], [], [])
+        data = os.read(fd, 4096)
+        if not data:
+            raise serial.SerialException("STM32 reported readiness to read but returned no data")
+        self.buffer += data
+
+    def recv_many(self) -> List[str]:
+        """Receive every complete message read from STM32 so far, blocking until at least one arrives
+
+        Returns:
+            List[str]: messages received, utf-8 decoded
+        """
+        while len(self.buffer) < 5:
+            self.fill_buffer()
+        size = len(self.buffer) - len(self.buffer) % 5
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        messages = [data[i:i + 5].strip().decode("utf-8") for i in range(0, size, 5)]
+        self.logger.debug(f"Received from STM32: {messages}")
+        return messages
+
+    def fileno(self) -> int:
+        """File descriptor of the serial link, so that it can be registered with a selector
+
+        Returns:
+            int: file descriptor of the opened serial port
+        """
+        return self.serial_link.fileno()
+
     def recv(self) -> Optional[str]:
         """Receive a message from STM32, utf-8 decoded
 
         Returns:
             Optional[str]: message received
         """
-        message = self.serial_link.read(5).strip().decode("utf-8")
+        while len(self.buffer) < 5:
+            self.fill_buffer()
+        message = bytes(self.buffer[:5]).strip().decode("utf-8")
+        del self.buffer[:5]
         self.logger.debug(f"Received from STM32: {message}")
         return message
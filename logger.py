@@ -1,10 +1,44 @@
+import atexit
 import logging
+import pickle
+import socket
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+# Writes the records of every process to the console and file, started with the first logger
+_listener: Optional[QueueListener] = None
+
+# Largest pickled record that fits in one datagram, bigger ones are reported by the handler and dropped
+_MAX_RECORD_SIZE = 1 << 18
+
+
+class _DatagramQueue:
+    """
+    Carries log records from every process to the listener over a Unix datagram socket pair.
+    Each record is sent as a single datagram, so unlike a multiprocessing.Queue there is no lock shared between
+    processes, and a child that is killed while logging cannot leave the other processes' records stuck.
+    """
+
+    def __init__(self):
+        self._reader, self._writer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._writer.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, _MAX_RECORD_SIZE)
+
+    def put_nowait(self, record: Optional[logging.LogRecord]) -> None:
+        self._writer.send(pickle.dumps(record))
+
+    def get(self, block: bool = True) -> Optional[logging.LogRecord]:
+        return pickle.loads(self._reader.recv(_MAX_RECORD_SIZE))
 
 
 def prepare_logger() -> logging.Logger:
     """
     Creates a logger that is able to both print to console and save to file.
+    The caller still builds the message (QueueHandler merges the arguments before sending the record), but the
+    formatting for each handler and the console and file I/O happen in a background thread of the process
+    that first prepared the logger. Child processes forked after that send their records to the same thread.
     """
+    global _listener
+
     log_format = logging.Formatter(
         '%(asctime)s :: %(levelname)s :: %(message)s')
 
@@ -22,8 +56,14 @@ def prepare_logger() -> logging.Logger:
         file_handler.setLevel(logging.DEBUG)
         file_handler.setFormatter(log_format)
 
+        # Queue shared with the listener, which feeds both handlers
+        log_queue = _DatagramQueue()
+        _listener = QueueListener(
+            log_queue, console_handler, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
         # Add handlers to logger
-        logger.addHandler(console_handler)
-        logger.addHandler(file_handler)
+        logger.addHandler(QueueHandler(log_queue))
 
     return logger
@@ -1,74 +1,172 @@
 from ultralytics import YOLO
+from picamera2 import Picamera2
 # import subprocess
 import numpy as np
 import cv2
-import math
 import os
+import platform
+import queue
+import threading
+import torch
+
+# Weights to load, fastest first. The exported models are made once by export_model() on the
+# device that runs the detection, the PyTorch weights are the fallback when nothing was exported yet
+MODEL_CANDIDATES = ("best.engine", "best_saved_model/best_int8.tflite", "best_int8_openvino_model",
+                    "best_ncnn_model", "best_openvino_model", "best.pt")
+
+# Function to export the PyTorch weights for this device, only needed once.
+# FP16 TensorRT with a CUDA GPU, otherwise NCNN on the Pi's ARM cores and OpenVINO on x86.
+# Given a dataset yaml of ~100 representative images to calibrate on, the weights are quantized to INT8
+# instead, through TFLite on ARM as its XNNPACK kernels use the NEON dot product instructions
+def export_model(weights="best.pt", data=None):
+    int8 = data is not None
+    if torch.cuda.is_available():
+        YOLO(weights).export(format="engine", half=not int8, int8=int8, data=data, imgsz=640, device=0)
+    elif platform.machine() in ("aarch64", "armv7l"):
+        if int8:
+            YOLO(weights).export(format="tflite", int8=True, data=data, imgsz=640)
+        else:
+            YOLO(weights).export(format="ncnn", half=True, imgsz=640)
+    else:
+        YOLO(weights).export(format="openvino", half=not int8, int8=int8, data=data, imgsz=640)
 
 # Initialize the YOLOv5 model
-model = YOLO("best.pt")
+model = YOLO(next(path for path in MODEL_CANDIDATES if os.path.exists(path)))
+
+# Run the PyTorch weights in FP16 on GPUs with native FP16 support (Volta/Turing onwards), an exported
+# engine already has its precision fixed and ignores it
+HALF = torch.cuda.is_available() and torch.cuda.get_device_capability()[0] >= 7
+
+# One dummy forward pass while loading, so that the backend's kernel setup and autotuning do not
+# land on the first real frame
+model.predict(np.zeros((640, 640, 3), dtype=np.uint8), half=HALF, verbose=False)
 
 # Object classes
 classNames = ["arrow-bullseye", "bullseye-arrow", "bullseye-arrow-bullseye", "id11", "id12", "id13", "id14", "id15", "id16", "id17", "id18", "id19",
               "id20", "id21", "id22", "id23", "id24", "id25", "id26", "id27", "id28", "id29", "id30", "id31", "id32", "id33", "id34", "id35", "id36",
               "id37", "id38", "id39", "id40", "id99"]
 
-# Function to capture image from libcamera using libcamera-still command
+# Names by the class id the model reports, where ids 38 and 39 come out swapped.
+# Done once here instead of for every detection
+classNamesFixed = list(classNames)
+if len(classNamesFixed) > 39:
+    classNamesFixed[38], classNamesFixed[39] = classNames[39], classNames[38]
+classNamesFixed = tuple(classNamesFixed)
+
+# Camera kept running between captures, started by the first capture_image()
+camera = None
+
+# Function to capture image from libcamera through picamera2.
+# The camera is only started once, so a capture does not pay for launching libcamera-still and
+# waiting for auto white balance again. The frame stays in memory, without a JPEG encode and decode
 def capture_image():
-    # Capture image using libcamera-still command
-    # command = ["libcamera-still", "-o", "image.jpg"]
-    # subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    os.system("libcamera-still -e jpg -n -t 500 -o image.jpg --awb auto")
+    global camera
+    if camera is None:
+        camera = Picamera2()
+        # RGB888 frames are laid out B, G, R, like the images OpenCV works with
+        camera.configure(camera.create_still_configuration(main={"format": "RGB888"}))
+        camera.start()
+    return camera.capture_array()
+
+# Number of frames captured and passed through the model together
+BATCH_SIZE = 4
+
+# Whether detections can be shown in a window, a headless Pi has no X11/Wayland display
+SHOW_IMAGES = bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+# Function to capture a batch of images, one after the other from the running camera
+def capture_images(count=BATCH_SIZE):
+    return [capture_image() for _ in range(count)]
 
-# Function to perform object detection on captured image
-def detect_objects_in_image():
-    # Read the captured image
-    img = cv2.imread("image.jpg")
+# Label text details
+font = cv2.FONT_HERSHEY_SIMPLEX
+fontScale = 7
+color = (0, 255, 0)
+thickness = 12
 
+# Label strokes by class name, each as a mask with the offset of its origin, see draw_label
+label_masks = {}
+# Solid label colour to copy through the masks, grown to the largest mask drawn so far
+label_fill = np.zeros((0, 0, 3), np.uint8)
+
+# Function to draw a class name with its baseline starting at (x, y), like cv2.putText.
+# Outlines this large are slow to rasterize, so each name is only drawn once into a mask and
+# later detections of it only copy the colour through that mask
+def draw_label(img, name, x, y):
+    global label_fill
+    if name not in label_masks:
+        (width, height), baseline = cv2.getTextSize(name, font, fontScale, thickness)
+        # Margin for strokes that reach past the measured text box
+        pad = 2 * thickness
+        mask = np.zeros((height + baseline + 2 * pad, width + 2 * pad), np.uint8)
+        cv2.putText(mask, name, (pad, height + pad), font, fontScale, 255, thickness)
+        label_masks[name] = (mask, pad, height + pad)
+        if mask.shape[0] > label_fill.shape[0] or mask.shape[1] > label_fill.shape[1]:
+            label_fill = np.full((max(mask.shape[0], label_fill.shape[0]),
+                                  max(mask.shape[1], label_fill.shape[1]), 3), color, np.uint8)
+    mask, origin_x, origin_y = label_masks[name]
+
+    # Clip the mask to the image, labels near the border are cut off the same way putText does
+    left, top = x - origin_x, y - origin_y
+    x0, y0 = max(left, 0), max(top, 0)
+    x1, y1 = min(left + mask.shape[1], img.shape[1]), min(top + mask.shape[0], img.shape[0])
+    if x0 < x1 and y0 < y1:
+        # A masked copy in OpenCV runs vectorized, unlike indexing the image with a boolean array
+        cv2.copyTo(label_fill[:y1 - y0, :x1 - x0], mask[y0 - top:y1 - top, x0 - left:x1 - left],
+                   img[y0:y1, x0:x1])
+
+# Function to perform object detection on a captured image
+def detect_objects_in_image(img):
+    detect_objects_in_images([img])
+
+# Function to perform object detection on a batch of captured images.
+# All of them go through the model in one call, which spreads the per-call overhead over the batch
+def detect_objects_in_images(imgs):
     # Perform object detection
-    results = model(img, stream=True)
+    results = model(imgs, stream=False, half=HALF)
 
     # Coordinates
-    for r in results:
-        boxes = r.boxes
-
-        for box in boxes:
-            # Bounding box
-            x1, y1, x2, y2 = box.xyxy[0]
-            x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)  # Convert to int values
+    for img, r in zip(imgs, results):
+        # Copied out of the tensors once per image instead of once per box and value.
+        # Each row of the boxes' data is x1, y1, x2, y2, confidence, class, so it is a single copy off the device
+        data = r.boxes.data.cpu().numpy()
+        xyxy = data[:, :4].astype(np.int32)
+        confidences = np.ceil(data[:, 4] * 100).astype(np.float64) / 100
+        classes = data[:, 5].astype(np.int32)
 
+        for (x1, y1, x2, y2), confidence, cls in zip(xyxy.tolist(), confidences.tolist(), classes.tolist()):
             # Draw box on the image
             cv2.rectangle(img, (x1, y1), (x2, y2), (255, 0, 255), 3)
 
             # Confidence
-            confidence = math.ceil((box.conf[0] * 100)) / 100
             print("Confidence --->", confidence)
 
             # Class name
-            cls = int(box.cls[0])
-            if cls == 38:
-                cls = 39
-            elif cls == 39:
-                cls = 38
-            print("Class name -->", classNames[cls])
-
-            # Object details
-            org = [x1, y1]
-            font = cv2.FONT_HERSHEY_SIMPLEX
-            fontScale = 7
-            color = (0, 255, 0)
-            thickness = 12
-
-            cv2.putText(img, classNames[cls], org, font, fontScale, color, thickness)
-
-    # Show the image
-    cv2.imshow('Image', img)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
+            name = classNamesFixed[cls]
+            print("Class name -->", name)
+
+            draw_label(img, name, x1, y1)
+
+    # Show the images, without waiting for a key so that the next batch is not held up.
+    # Without a display they are written to the ramdisk instead, the latest batch overwriting the last one
+    for i, img in enumerate(imgs):
+        if SHOW_IMAGES:
+            cv2.imshow('Image', img)
+            cv2.waitKey(1)
+        else:
+            cv2.imwrite(f"/dev/shm/out_{i}.jpg", img)
+
+# Function to keep capturing batches of images into the queue. It runs on its own thread, so capturing
+# the next batch overlaps with detection on the current one, both release the GIL while they work
+def capture_batches(batches):
+    while True:
+        batches.put(capture_images())
 
 if __name__ == '__main__':
-    # Capture image
-    capture_image()
+    # Captured batches waiting for detection, bounded so that capture does not run far ahead
+    batches = queue.Queue(maxsize=2)
+    threading.Thread(target=capture_batches, args=(batches,), daemon=True).start()
 
-    # Perform object detection on captured image
-    detect_objects_in_image()
+    # Perform object detection on captured images as they come in
+    while True:
+        detect_objects_in_images(batches.get())
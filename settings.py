@@ -6,6 +6,8 @@ BAUD_RATE = 115200
 API_IP = '192.168.32.65'  # IP address of laptop
 # API_IP = 'localhost'  # IP address of laptop
 API_PORT = 5000
+# Length-prefixed image-rec endpoint, HTTP is used instead if it is not running
+API_PORT_BIN = 5001
 
 # ROBOT SETTINGS
 OUTDOOR_BIG_TURN = False
@@ -1,7 +1,10 @@
 import time
 import sys
 import logging
-from multiprocessing import Process, Manager
+import os
+import selectors
+import threading
+import serial
 from communication.stm32 import STMLink
 
 class RaspberryPi:
@@ -14,9 +17,16 @@ class RaspberryPi:
         Initializes the Raspberry Pi.
         """
         self.stm_link = STMLink()
-        self.manager = Manager()
-        self.movement_lock = self.manager.Value('i', 0)  # Using Value as a flag
-        self.current_location = self.manager.dict()
+        # Written by recv_stm once the STM32 acknowledges a command
+        self.ack_fd = os.eventfd(0, os.EFD_CLOEXEC | os.EFD_NONBLOCK)
+        # The movement waits on the ACK eventfd through its own selector
+        self.ack_selector = selectors.DefaultSelector()
+        self.ack_selector.register(self.ack_fd, selectors.EVENT_READ)
+        # Held for the whole send-and-wait-for-ACK sequence of a movement
+        self.send_lock = threading.Lock()
+        # Every link's fd is registered here, and a single thread waits on all of them
+        self.selector = selectors.DefaultSelector()
+        self.current_location = {}
 
         # Initialize logger
         self.logger = logging.getLogger(__name__)
@@ -30,9 +40,12 @@ class RaspberryPi:
         """Starts the RPi orchestrator"""
         try:
             self.stm_link.connect()
-            self.proc_recv_stm32 = Process(target=self.recv_stm)
+            # Give the STM32 time to settle after the serial port is opened
+            time.sleep(1)
+            self.selector.register(self.stm_link.fileno(), selectors.EVENT_READ, self.recv_stm)
+            self.proc_recv_stm32 = threading.Thread(target=self.poll_links, daemon=True)
             self.proc_recv_stm32.start()
-            self.logger.info("Child Process started")
+            self.logger.info("Receiver thread started")
 
             ### Start up complete ###
             self.move_forward()
@@ -42,45 +55,69 @@ class RaspberryPi:
 
     def stop(self):
         """Stops all processes on the RPi and disconnects gracefully with STM32"""
+        self.selector.close()
+        self.ack_selector.close()
+        os.close(self.ack_fd)
         self.stm_link.disconnect()
 
-    def recv_stm(self) -> None:
+    def poll_links(self) -> None:
         """
-        [Child Process] Receive acknowledgement messages from STM32, and release the movement lock
+        [Thread] Wait on all registered links at once, and hand each readable one to its callback
         """
         while True:
-            message: str = self.stm_link.recv()
+            for key, _ in self.selector.select():
+                key.data(key.fd)
+
+    def recv_stm(self, fd: int) -> None:
+        """
+        Receive acknowledgement messages from STM32, and signal the waiting movement
+        """
+        # The selector reported the fd readable, STMLink frames whatever was read into 5-byte messages
+        try:
+            messages = self.stm_link.recv_many()
+        except serial.SerialException as e:
+            # The port hung up, it would be reported readable forever
+            self.selector.unregister(fd)
+            self.logger.error(f"STM32 link lost: {e}")
+            return
+        for message in messages:
             print(message)
             if message.startswith("ACK"):
-                self.movement_lock.value = 0  # Release the lock
-                self.logger.debug("ACK from STM32 received, movement lock released.")
+                os.eventfd_write(self.ack_fd, 1)
+                self.logger.debug("ACK from STM32 received, movement signalled.")
             else:
                 self.logger.warning(f"Ignored unknown message from STM: {message}")
 
+    def drain_ack(self) -> None:
+        """
+        Reset the ACK eventfd, ignoring it if no ACK has been received
+        """
+        try:
+            os.eventfd_read(self.ack_fd)
+        except BlockingIOError:
+            pass
+
     def move_forward(self):
         """
         Moves the robot forward by sending commands to the STM32
         """
         # Acquire movement lock before sending command
-        while True:
-            if self.movement_lock.value == 0:  # Check if lock is released
-                self.movement_lock.value = 1  # Acquire the lock
-                break
-            time.sleep(0.1)  # Wait for a short while before checking again
-        # Send forward command to STM32
-        time.sleep(1)   
-        
-        self.stm_link.send("FR180")
-
-        #self.stm_link.send("FW...")
-
-        # time.sleep(float(sys.argv[1]))
-        # self.stm_link.send("Sxxxx")
-        #time.sleep(3)
-        #self.stm_link.send("SSSSS")
-        # Wait for acknowledgement from STM32
-        while self.movement_lock.value == 1:  # Wait until the lock is released
-            time.sleep(0.1)
+        with self.send_lock:
+            # Drop any stale ACK so that we only wake up for this movement
+            self.drain_ack()
+            # Send forward command to STM32
+
+            self.stm_link.send("FR180")
+
+            #self.stm_link.send("FW...")
+
+            # time.sleep(float(sys.argv[1]))
+            # self.stm_link.send("Sxxxx")
+            #time.sleep(3)
+            #self.stm_link.send("SSSSS")
+            # Wait for acknowledgement from STM32
+            self.ack_selector.select()
+            self.drain_ack()
         # After receiving acknowledgement, update location
         # self.current_location['x'] += 1  # Assuming x-coordinate increment by 1 for simplicity
         self.logger.info(f"Robot moved forward. New location: {self.current_location}")
@@ -1,7 +1,7 @@
 import time
 import sys
 import logging
-from multiprocessing import Process, Manager
+import threading
 from communication.stm32 import STMLink
 
 class RaspberryPi:
@@ -14,9 +14,9 @@ class RaspberryPi:
         Initializes the Raspberry Pi.
         """
         self.stm_link = STMLink()
-        self.manager = Manager()
-        self.movement_lock = self.manager.Value('i', 0)  # Using Value as a flag
-        self.current_location = self.manager.dict()
+        # Set by recv_stm once the STM32 acknowledges a command
+        self.ack_event = threading.Event()
+        self.current_location = {}
 
         # Initialize logger
         self.logger = logging.getLogger(__name__)
@@ -30,9 +30,9 @@ class RaspberryPi:
         """Starts the RPi orchestrator"""
         try:
             self.stm_link.connect()
-            self.proc_recv_stm32 = Process(target=self.recv_stm)
+            self.proc_recv_stm32 = threading.Thread(target=self.recv_stm, daemon=True)
             self.proc_recv_stm32.start()
-            self.logger.info("Child Process started")
+            self.logger.info("Receiver thread started")
 
             ### Start up complete ###
             self.move_forward()
@@ -46,14 +46,14 @@ class RaspberryPi:
 
     def recv_stm(self) -> None:
         """
-        [Child Process] Receive acknowledgement messages from STM32, and release the movement lock
+        [Thread] Receive acknowledgement messages from STM32, and signal the waiting movement
         """
         while True:
             message: str = self.stm_link.recv()
             print(message)
             if message.startswith("ACK"):
-                self.movement_lock.value = 0  # Release the lock
-                self.logger.debug("ACK from STM32 received, movement lock released.")
+                self.ack_event.set()  # Release the waiting movement
+                self.logger.debug("ACK from STM32 received, movement signalled.")
             else:
                 self.logger.warning(f"Ignored unknown message from STM: {message}")
 
@@ -61,13 +61,9 @@ class RaspberryPi:
         """
         Moves the robot forward by sending commands to the STM32
         """
-        # Acquire movement lock before sending command
-        while True:
-            if self.movement_lock.value == 0:  # Check if lock is released
-                self.movement_lock.value = 1  # Acquire the lock
-                break
-            time.sleep(0.1)  # Wait for a short while before checking again
-        
+        # Drop any stale ACK so that we only wake up for this movement
+        self.ack_event.clear()
+
         # Send forward command to STM32
         time.sleep(1)
         self.stm_link.send("S")
@@ -81,11 +77,10 @@ class RaspberryPi:
         # Stop the robot
         self.stm_link.send("F")
         for i in range(4):
-        self.stm_link.send("S")
+            self.stm_link.send("S")
         
         # Wait for acknowledgement from STM32
-        while self.movement_lock.value == 1:  # Wait until the lock is released
-            time.sleep(0.1)
+        self.ack_event.wait()
         
         # After receiving acknowledgement, update location
         self.current_location['x'] += 1  # Assuming x-coordinate increment by 1 for simplicity
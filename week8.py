@@ -1,38 +1,161 @@
 #!/usr/bin/env python3
+import io
 import json
 import queue
+import socket
+import struct
 import time
-from multiprocessing import Process, Manager
-from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import Event, Lock, Process, Manager, Queue, Value
+from multiprocessing.sharedctypes import RawArray, RawValue
+from typing import Any, NamedTuple, Optional
 import os
-import requests
+import urllib3
+from libcamera import controls
+from picamera2 import Picamera2
 from communication.android import AndroidLink, AndroidMessage
 from communication.stm32 import STMLink
 from consts import SYMBOL_MAP
 from logger import prepare_logger
-from settings import API_IP, API_PORT
+from settings import API_IP, API_PORT, API_PORT_BIN
+
+# Camera options, indexed by the values stored in PiLCConfig9.txt
+_SHUTTERS = (-2000, -1600, -1250, -1000, -800, -640, -500, -400, -320, -288, -250, -240, -200, -160, -144, -125, -120, -100, -96, -80, -60, -50, -48, -40, -30, -25, -20, -
+             15, -13, -10, -8, -6, -5, -4, -3, 0.4, 0.5, 0.6, 0.8, 1, 1.1, 1.2, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 15, 20, 25, 30, 40, 50, 60, 75, 100, 112, 120, 150, 200, 220, 230, 239, 435)
+# centre, spot, average
+_METERS = (controls.AeMeteringModeEnum.CentreWeighted, controls.AeMeteringModeEnum.Spot,
+           controls.AeMeteringModeEnum.Matrix)
+# 'off' has no mode, the red and blue gains from the config are used instead
+_AWBS = (None, controls.AwbModeEnum.Auto, controls.AwbModeEnum.Incandescent, controls.AwbModeEnum.Tungsten,
+         controls.AwbModeEnum.Fluorescent, controls.AwbModeEnum.Indoor, controls.AwbModeEnum.Daylight,
+         controls.AwbModeEnum.Cloudy)
+# off, cdn_off, cdn_fast, cdn_hq
+_DENOISES = (controls.draft.NoiseReductionModeEnum.Off, controls.draft.NoiseReductionModeEnum.Minimal,
+             controls.draft.NoiseReductionModeEnum.Fast, controls.draft.NoiseReductionModeEnum.HighQuality)
+
+# Commands forwarded straight to the STM32, matched on their first two characters ("ST" is STOP)
+STM32_PREFIXES = frozenset({"FS", "BS", "FW", "BW", "FL", "FR", "BL", "BR", "TL", "TR", "DT", "ST", "ZZ", "RS"})
+# The few STM32 commands that are told apart by their first character only
+STM32_SHORT_PREFIXES = frozenset({"A", "C"})
+
+# CPU cores the processes are pinned to, so that the scheduler does not migrate them between the Pi's 4 cores
+MAIN_CORE = 0  # main process and rpi_action
+STM_CORE = 1  # recv_stm, on the ACK path of every command
+CAMERA_CORE = 2  # command_follower, which also runs the captures
+ANDROID_CORE = 3  # recv_android and android_sender
+# SCHED_FIFO priority of recv_stm, so that ACKs never wait behind camera work
+STM_PRIORITY = 50
+
+
+class PathRing:
+    """
+    Single-producer single-consumer ring buffer of (x, y, d) positions, kept in shared memory.
+    The capacity is a power of two so that positions wrap with a bitmask.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        """
+        :param capacity: The number of positions the ring can hold. Must be a power of two.
+        """
+        if capacity & (capacity - 1):
+            raise ValueError(f"Capacity must be a power of two: {capacity}")
+        self._mask = capacity - 1
+        self._capacity = capacity
+        self._buffer = RawArray("i", capacity * 3)
+        # Next position to read, only written by the consumer
+        self._head = RawValue("Q", 0)
+        # Next position to write, only written by the producer
+        self._tail = RawValue("Q", 0)
+        # Positions before this one were cleared, only written by the producer
+        self._start = RawValue("Q", 0)
+
+    def put(self, x: int, y: int, d: int) -> None:
+        """
+        Appends a position, yielding the CPU until the consumer frees a slot if the ring is full
+        :param x: The x coordinate.
+        :param y: The y coordinate.
+        :param d: The direction.
+        """
+        # Cleared positions are free again even if the consumer has not skipped past them yet
+        while self._tail.value - max(self._head.value, self._start.value) == self._capacity:
+            os.sched_yield()
+        start = (self._tail.value & self._mask) * 3
+        self._buffer[start:start + 3] = (x, y, d)
+        self._tail.value += 1
+
+    def pop(self) -> Optional[dict]:
+        """
+        Removes and returns the oldest position that was not cleared
+        :return: The position as a dict with 'x', 'y' and 'd', or None if the ring is empty.
+        """
+        head = max(self._head.value, self._start.value)
+        if head == self._tail.value:
+            self._head.value = head
+            return None
+        start = (head & self._mask) * 3
+        x, y, d = self._buffer[start:start + 3]
+        self._head.value = head + 1
+        return {'x': x, 'y': y, 'd': d}
+
+    def clear(self) -> None:
+        """
+        Drops every position in the ring. Called by the producer, the consumer skips them on its next `pop`.
+        """
+        self._start.value = self._tail.value
 
 
-class PiAction:
+class ObstacleList:
     """
-    Class that represents an action that the RPi needs to take.    
+    Append-only list of obstacles, kept in shared memory as (id, x, y, d) ints.
+    Only one process appends, the others read a copy of the obstacles appended so far.
     """
 
-    def __init__(self, cat, value):
+    _FIELDS = ('id', 'x', 'y', 'd')
+
+    def __init__(self, capacity: int = 64):
         """
-        :param cat: The category of the action. Can be 'info', 'mode', 'path', 'snap', 'obstacle', 'location', 'failed', 'success'
-        :param value: The value of the action. Can be a string, a list of coordinates, or a list of obstacles.
+        :param capacity: The number of obstacles the list can hold.
         """
-        self._cat = cat
-        self._value = value
+        self._capacity = capacity
+        self._buffer = RawArray("i", capacity * 4)
+        # Number of obstacles written, only bumped once the obstacle is complete
+        self._count = RawValue("Q", 0)
 
-    @property
-    def cat(self):
-        return self._cat
+    def append(self, obstacle: dict) -> None:
+        """
+        :param obstacle: The obstacle as a dict with 'id', 'x', 'y' and 'd'.
+        """
+        count = self._count.value
+        if count == self._capacity:
+            raise ValueError(f"Obstacle list is full: {obstacle}")
+        start = count * 4
+        self._buffer[start:start + 4] = [obstacle[field] for field in self._FIELDS]
+        self._count.value = count + 1
+
+    def copy(self) -> list:
+        """
+        :return: The obstacles appended so far, as new dicts.
+        """
+        values = self._buffer[:self._count.value * 4]
+        return [dict(zip(self._FIELDS, values[i:i + 4])) for i in range(0, len(values), 4)]
 
-    @property
-    def value(self):
-        return self._value
+    def __len__(self) -> int:
+        return self._count.value
+
+    def __repr__(self) -> str:
+        return repr(self.copy())
+
+
+class PiAction(NamedTuple):
+    """
+    Class that represents an action that the RPi needs to take.
+    A tuple, so that it pickles small onto the action queue.
+    :param cat: The category of the action. Can be 'info', 'mode', 'path', 'snap', 'obstacle', 'location', 'failed', 'success'
+    :param value: The value of the action. Can be a string, a list of coordinates, or a list of obstacles.
+    """
+
+    cat: str
+    value: Any
 
 
 class RaspberryPi:
@@ -50,18 +173,24 @@ class RaspberryPi:
 
         self.manager = Manager()
 
-        self.android_dropped = self.manager.Event()
-        self.unpause = self.manager.Event()
+        # Semaphore based and inherited on fork, so waiting on them does not go through the Manager
+        self.android_dropped = Event()
+        self.unpause = Event()
+        # Set while a plan from the Algo API is waiting to be followed
+        self.plan_queued = Event()
 
-        self.movement_lock = self.manager.Lock()
+        self.movement_lock = Lock()
 
         self.android_queue = self.manager.Queue()  # Messages to send to Android
+        # The queues below are written by the child processes themselves, so they go over pipes instead of the Manager
         # Messages that need to be processed by RPi
-        self.rpi_action_queue = self.manager.Queue()
-        # Messages that need to be processed by STM32, as well as snap commands
-        self.command_queue = self.manager.Queue()
-        # X,Y,D coordinates of the robot after execution of a command
-        self.path_queue = self.manager.Queue()
+        self.rpi_action_queue = Queue()
+        # Messages that need to be processed by STM32, as well as snap commands, one list per plan
+        self.command_queue = Queue()
+        # X,Y,D coordinates of the robot after execution of a command, popped by recv_stm on every ACK
+        self.path_queue = PathRing()
+        # Bumped whenever the queues are cleared, so that command_follower drops what is left of an older plan
+        self.plan_generation = Value('i', 0, lock=False)
 
         self.proc_recv_android = None
         self.proc_recv_stm32 = None
@@ -70,12 +199,74 @@ class RaspberryPi:
         self.proc_rpi_action = None
         self.rs_flag = False
 
-        self.success_obstacles = self.manager.list()
-        self.failed_obstacles = self.manager.list()
-        self.obstacles = self.manager.dict()
-        self.current_location = self.manager.dict()
+        # Appended to by the snap callbacks in command_follower, read by command_follower at the end of the path
+        self.success_obstacles = ObstacleList()
+        self.failed_obstacles = ObstacleList()
+        # Only used inside command_follower, filled from the plans it receives, so it does not need to be shared
+        self.obstacles = {}
+        # X, Y, D of the robot, written by recv_stm and read by command_follower
+        self.current_location = RawArray("i", 3)
         self.failed_attempt = False
 
+        # API endpoints, formatted once
+        base_url = f"http://{API_IP}:{API_PORT}"
+        self._image_url = base_url + "/image"
+        self._path_url = base_url + "/path"
+        self._stitch_url = base_url + "/stitch"
+        self._status_url = base_url + "/status"
+
+        # Created lazily inside the child process that uses them, see `http`, `command_follower` and `rpi_action`
+        self._http: Optional[urllib3.PoolManager] = None
+        self._http_pid: Optional[int] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._api_executor: Optional[ThreadPoolExecutor] = None
+        self._camera: Optional[Picamera2] = None
+        self._image_sock: Optional[socket.socket] = None
+        # Cleared once the binary image endpoint fails, so the rest of the run goes over HTTP
+        self._use_image_sock = True
+
+        self.load_camera_config()
+
+    def load_camera_config(self):
+        """
+        Reads the camera settings saved by Pi_LibCamera_GUI into PiLCConfig9.txt.
+        The file does not change during a run, so it is parsed once instead of on every snap.
+        """
+        config_file = "/home/" + os.getlogin() + "/PiLCConfig9.txt"
+        with open(config_file, "r") as file:
+            config = list(map(int, file.read().splitlines()))
+        self.cam_speed = config[1]
+        self.cam_quality = config[24]
+
+        # Camera controls that are the same for every capture, only the shutter speed changes
+        gain, red, blue, ev = config[2], config[6], config[7], config[8]
+        meter, awb, denoise = config[20], config[21], config[23]
+        self._cam_controls = {"Brightness": config[3]/100, "Contrast": config[4]/100,
+                              "Saturation": config[19]/10, "Sharpness": config[22]/10,
+                              "ExposureValue": ev,
+                              "AeMeteringMode": _METERS[meter],
+                              "NoiseReductionMode": _DENOISES[denoise]}
+        if gain != 0:
+            self._cam_controls["AnalogueGain"] = gain
+        if awb == 0:
+            self._cam_controls["AwbEnable"] = False
+            self._cam_controls["ColourGains"] = (red/10, blue/10)
+        else:
+            self._cam_controls["AwbMode"] = _AWBS[awb]
+
+    def open_camera(self):
+        """
+        Starts the camera with the settings from PiLCConfig9.txt.
+        It is kept running, so a retry only changes the shutter speed instead of relaunching libcamera-still.
+        """
+        self._camera = Picamera2()
+        self._camera.configure(self._camera.create_still_configuration())
+        self._camera.options["quality"] = self.cam_quality
+        self._camera.set_controls(self._cam_controls)
+        self._camera.start()
+        # Exposure time last applied to the running camera, in microseconds
+        self._cam_exposure: Optional[int] = None
+
     def start(self):
         """Starts the RPi orchestrator"""
         try:
@@ -95,11 +286,16 @@ class RaspberryPi:
             self.proc_rpi_action = Process(target=self.rpi_action)
 
             # Start child processes
+            os.sched_setaffinity(0, {MAIN_CORE})
             self.proc_recv_android.start()
             self.proc_recv_stm32.start()
             self.proc_android_sender.start()
             self.proc_command_follower.start()
             self.proc_rpi_action.start()
+            self.pin_process(self.proc_recv_android, ANDROID_CORE)
+            self.pin_process(self.proc_recv_stm32, STM_CORE, priority=STM_PRIORITY)
+            self.pin_process(self.proc_android_sender, ANDROID_CORE)
+            self.pin_process(self.proc_command_follower, CAMERA_CORE)
 
             self.logger.info("Child Processes started")
 
@@ -115,10 +311,28 @@ class RaspberryPi:
 
     def stop(self):
         """Stops all processes on the RPi and disconnects gracefully with Android and STM32"""
+        # Wakes rpi_action and command_follower from their blocking gets, so that they can finish the work in progress
+        self.rpi_action_queue.put(PiAction(cat="stop", value=None))
+        self.command_queue.put(None)
         self.android_link.disconnect()
         self.stm_link.disconnect()
         self.logger.info("Program exited!")
 
+    def pin_process(self, proc: Process, core: int, priority: Optional[int] = None) -> None:
+        """
+        Pins a started child process to a CPU core, and optionally gives it a real-time priority
+        :param proc: the started child process
+        :param core: the CPU core to run on
+        :param priority: SCHED_FIFO priority, or None to keep the default scheduler
+        """
+        os.sched_setaffinity(proc.pid, {core})
+        if priority is None:
+            return
+        try:
+            os.sched_setscheduler(proc.pid, os.SCHED_FIFO, os.sched_param(priority))
+        except PermissionError:
+            self.logger.warning("No permission to set real-time priority of process %s", proc.pid)
+
     def reconnect_android(self):
         """Handles the reconnection to Android in the event of a lost connection."""
         self.logger.info("Reconnection handler is watching...")
@@ -154,6 +368,8 @@ class RaspberryPi:
             # Start previously killed processes
             self.proc_recv_android.start()
             self.proc_android_sender.start()
+            self.pin_process(self.proc_recv_android, ANDROID_CORE)
+            self.pin_process(self.proc_android_sender, ANDROID_CORE)
 
             self.logger.info("Android child processes restarted")
             self.android_queue.put(AndroidMessage(
@@ -171,25 +387,17 @@ class RaspberryPi:
             try:
                 msg_str = self.android_link.recv()
             except OSError:
+                pass
+
+            # recv returns an empty string once the connection is broken
+            if not msg_str:
                 self.android_dropped.set()
                 self.logger.debug("Event set: Android connection dropped")
-
-            if msg_str is None:
-                continue
-            
-            try:
-                message: dict = json.loads(msg_str)
-            except:
-                print(f"Receive message {msg_str}")
                 return
-            ## Command: Set obstacles ##
-            if message['cat'] == "obstacles":
-                self.rpi_action_queue.put(PiAction(**message))
-                self.logger.debug(
-                    f"Set obstacles PiAction added to queue: {message}")
 
             ## Command: Start Moving ##
-            if message == "START":
+            # Sent as a bare string, which is not JSON, so it is matched before parsing
+            if msg_str == "START":
                 # Check API
                 if not self.check_api():
                     self.logger.error(
@@ -198,12 +406,12 @@ class RaspberryPi:
                         'error', "API is down, start command aborted."))
 
                 # Commencing path following
-                if not self.command_queue.empty():
+                if self.plan_queued.is_set():
                     self.logger.info("Gryo reset!")
                     self.stm_link.send("RS00")
                     # Main trigger to start movement #
                     self.unpause.set()
-                    self.logger.infoserial.serialutil.SerialException(
+                    self.logger.info(
                         "Start command received, starting robot on path!")
                     self.android_queue.put(AndroidMessage(
                         'info', 'Starting robot on path!'))
@@ -214,6 +422,18 @@ class RaspberryPi:
                         "The command queue is empty, please set obstacles.")
                     self.android_queue.put(AndroidMessage(
                         "error", "Command queue is empty, did you set obstacles?"))
+                continue
+
+            try:
+                message = json.loads(msg_str)
+            except json.JSONDecodeError:
+                self.logger.warning("Ignored invalid message from Android: %s", msg_str)
+                continue
+            ## Command: Set obstacles ##
+            if isinstance(message, dict) and message.get('cat') == "obstacles":
+                self.rpi_action_queue.put(PiAction(**message))
+                self.logger.debug(
+                    "Set obstacles PiAction added to queue: %s", message)
 
     def recv_stm(self) -> None:
         """
@@ -237,13 +457,14 @@ class RaspberryPi:
                     self.logger.debug(
                         "ACK from STM32 received, movement lock released.")
 
-                    cur_location = self.path_queue.get_nowait()
+                    cur_location = self.path_queue.pop()
+                    if cur_location is None:
+                        self.logger.warning("ACK from STM32 received, but no position is left in the path.")
+                        continue
 
-                    self.current_location['x'] = cur_location['x']
-                    self.current_location['y'] = cur_location['y']
-                    self.current_location['d'] = cur_location['d']
+                    self.current_location[:] = [cur_location['x'], cur_location['y'], cur_location['d']]
                     self.logger.info(
-                        f"self.current_location = {self.current_location}")
+                        "self.current_location = %s", cur_location)
                     self.android_queue.put(AndroidMessage('location', {
                         "x": cur_location['x'],
                         "y": cur_location['y'],
@@ -254,7 +475,7 @@ class RaspberryPi:
                     self.logger.warning("Tried to release a released lock!")
             else:
                 self.logger.warning(
-                    f"Ignored unknown message from STM: {message}")
+                    "Ignored unknown message from STM: %s", message)
 
     def android_sender(self) -> None:
         """
@@ -275,222 +496,289 @@ class RaspberryPi:
 
     def command_follower(self) -> None:
         """
-        [Child Process] 
+        [Child Process] Follows the commands of each plan, and snaps the obstacles on the way
         """
+        # Snaps run in a thread of this process, only one capture can own the camera at a time
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.open_camera()
         while True:
-            # Retrieve next movement command
-            command: str = self.command_queue.get()
-            self.logger.debug("wait for unpause")
-            # Wait for unpause event to be true [Main Trigger]
-            try:
-                self.logger.debug("wait for retrylock")
-                self.retrylock.acquire()
-                self.retrylock.release()
-            except:
+            # Retrieve the next batch of movement commands, then follow it locally
+            plan = self.command_queue.get()
+            if plan is None:
+                self._executor.shutdown(wait=True)
+                self._camera.close()
+                return
+            generation, commands, obstacles = plan
+            for obs in obstacles:
+                self.obstacles[obs['id']] = obs
+            for command in commands:
+                # The queues were cleared for a new plan, drop the rest of this one
+                if generation != self.plan_generation.value:
+                    break
                 self.logger.debug("wait for unpause")
-                self.unpause.wait()
-            self.logger.debug("wait for movelock")
-            # Acquire lock first (needed for both moving, and snapping pictures)
-            self.movement_lock.acquire()
-
-            # STM32 Commands - Send straight to STM32
-            stm32_prefixes = ("FS", "BS", "FW", "BW", "FL", "FR", "BL",
-                              "BR", "TL", "TR", "A", "C", "DT", "STOP", "ZZ", "RS")
-            if command.startswith(stm32_prefixes):
-                self.stm_link.send(command)
-                self.logger.debug(f"Sending to STM32: {command}")
-
-            # Snap command
-            elif command.startswith("SNAP"):
-                obstacle_id_with_signal = command.replace("SNAP", "")
-
-                self.rpi_action_queue.put(
-                    PiAction(cat="snap", value=obstacle_id_with_signal))
-
-            # End of path
-            elif command == "FIN":
-                self.logger.info(
-                    f"At FIN, self.failed_obstacles: {self.failed_obstacles}")
-                self.logger.info(
-                    f"At FIN, self.current_location: {self.current_location}")
-                if len(self.failed_obstacles) != 0 and self.failed_attempt == False:
-
-                    new_obstacle_list = list(self.failed_obstacles)
-                    for i in list(self.success_obstacles):
-                        # {'x': 5, 'y': 11, 'id': 1, 'd': 4}
-                        i['d'] = 8
-                        new_obstacle_list.append(i)
-
-                    self.logger.info("Attempting to go to failed obstacles")
-                    self.failed_attempt = True
-                    self.request_algo({'obstacles': new_obstacle_list, 'mode': '0'},
-                                      self.current_location['x'], self.current_location['y'], self.current_location['d'], retrying=True)
-                    self.retrylock = self.manager.Lock()
+                # Wait for unpause event to be true [Main Trigger]
+                try:
+                    self.logger.debug("wait for retrylock")
+                    self.retrylock.acquire()
+                    self.retrylock.release()
+                except:
+                    self.logger.debug("wait for unpause")
+                    self.unpause.wait()
+                self.logger.debug("wait for movelock")
+                # Acquire lock first (needed for both moving, and snapping pictures)
+                self.movement_lock.acquire()
+
+                # STM32 Commands - Send straight to STM32
+                if command[:2] in STM32_PREFIXES or command[:1] in STM32_SHORT_PREFIXES:
+                    self.stm_link.send(command)
+                    self.logger.debug("Sending to STM32: %s", command)
+
+                # Snap command
+                elif command.startswith("SNAP"):
+                    obstacle_id_with_signal = command.replace("SNAP", "")
+
+                    # snap_and_rec releases the movement lock once it is done
+                    future = self._executor.submit(
+                        self.snap_and_rec, obstacle_id_with_signal=obstacle_id_with_signal)
+                    future.add_done_callback(self._handle_rec_result)
+
+                # End of path
+                elif command == "FIN":
+                    self.logger.info(
+                        "At FIN, self.failed_obstacles: %s", self.failed_obstacles)
+                    robot_x, robot_y, robot_dir = self.current_location
+                    self.logger.info(
+                        "At FIN, self.current_location: %s", (robot_x, robot_y, robot_dir))
+                    if len(self.failed_obstacles) != 0 and self.failed_attempt == False:
+
+                        new_obstacle_list = self.failed_obstacles.copy()
+                        for i in self.success_obstacles.copy():
+                            # {'x': 5, 'y': 11, 'id': 1, 'd': 4}
+                            i['d'] = 8
+                            new_obstacle_list.append(i)
+
+                        self.logger.info("Attempting to go to failed obstacles")
+                        self.failed_attempt = True
+                        self.request_algo({'obstacles': new_obstacle_list, 'mode': '0'},
+                                          robot_x, robot_y, robot_dir, retrying=True)
+                        self.retrylock = self.manager.Lock()
+                        self.movement_lock.release()
+                        continue
+
+                    self.unpause.clear()
+                    self.plan_queued.clear()
                     self.movement_lock.release()
-                    continue
+                    self.logger.info("Commands queue finished.")
+                    self.android_queue.put(AndroidMessage(
+                        "info", "Commands queue finished."))
+                    self.android_queue.put(AndroidMessage("status", "finished"))
+                    self.rpi_action_queue.put(PiAction(cat="stitch", value=""))
+                else:
+                    raise Exception(f"Unknown command: {command}")
 
-                self.unpause.clear()
-                self.movement_lock.release()
-                self.logger.info("Commands queue finished.")
-                self.android_queue.put(AndroidMessage(
-                    "info", "Commands queue finished."))
-                self.android_queue.put(AndroidMessage("status", "finished"))
-                self.rpi_action_queue.put(PiAction(cat="stitch", value=""))
-            else:
-                raise Exception(f"Unknown command: {command}")
+    @property
+    def http(self) -> urllib3.PoolManager:
+        """
+        Returns the connection pool used to talk to the API, so that connections are kept alive between requests.
+        Pools are not fork-safe, so each process creates its own on first use.
+        Requests are not retried, as with a plain requests session.
+        """
+        if self._http is None or self._http_pid != os.getpid():
+            self._http = urllib3.PoolManager(num_pools=1, maxsize=4, retries=False)
+            self._http_pid = os.getpid()
+        return self._http
+
+    def recv_exact(self, sock: socket.socket, size: int) -> bytes:
+        """
+        Reads exactly `size` bytes from the socket
+        :param sock: the connected socket
+        :param size: the number of bytes to read
+        :return: the bytes read
+        """
+        data = bytearray()
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Image API closed the connection")
+            data += chunk
+        return bytes(data)
+
+    def request_image_rec(self, filename: str, image: bytes, obstacle_id: str, signal: str) -> Optional[dict]:
+        """
+        Sends a captured image to the image-rec API and returns its results.
+        The image goes over a persistent socket as a `>QI1s` header (image length, obstacle id, signal) followed by
+        the JPEG bytes, and the reply is a 4-byte length followed by the JSON results.
+        If the socket endpoint is not available, the image is posted to the HTTP API instead.
+        :param filename: the name the API saves the image under
+        :param image: the captured JPEG
+        :param obstacle_id: the current obstacle ID
+        :param signal: the signal of the current obstacle
+        :return: the image-rec results, or None if the API request failed
+        """
+        if self._use_image_sock:
+            try:
+                if self._image_sock is None:
+                    self._image_sock = socket.create_connection((API_IP, API_PORT_BIN), timeout=5)
+                self._image_sock.sendall(
+                    struct.pack(">QI1s", len(image), int(obstacle_id), signal.encode("utf-8")) + image)
+                size, = struct.unpack(">I", self.recv_exact(self._image_sock, 4))
+                return json.loads(self.recv_exact(self._image_sock, size))
+            except OSError as e:
+                self.logger.warning("Image socket unavailable, falling back to HTTP: %s", e)
+                if self._image_sock is not None:
+                    self._image_sock.close()
+                    self._image_sock = None
+                self._use_image_sock = False
+
+        response = self.http.request(
+            "POST", self._image_url, fields={"file": (filename, image, "image/jpeg")})
+
+        if response.status != 200:
+            self.logger.error(
+                "Something went wrong when requesting path from image-rec API. Please try again.")
+            return None
+
+        return json.loads(response.data)
 
     def rpi_action(self):
         """
-        [Child Process] 
+        [Child Process] Blocks on the rpi action queue and carries out each action, until a stop action arrives
         """
+        # Algo and stitch requests run in the background, so that the next action is not held up
+        self._api_executor = ThreadPoolExecutor(max_workers=1)
         while True:
             action: PiAction = self.rpi_action_queue.get()
             self.logger.debug(
-                f"PiAction retrieved from queue: {action.cat} {action.value}")
+                "PiAction retrieved from queue: %s %s", action.cat, action.value)
 
             if action.cat == "obstacles":
-                for obs in action.value['obstacles']:
-                    self.obstacles[obs['id']] = obs
-                self.request_algo(action.value)
-            elif action.cat == "snap":
-                self.snap_and_rec(obstacle_id_with_signal=action.value)
+                self._api_executor.submit(self.request_algo, action.value).add_done_callback(
+                    self._log_api_failure)
             elif action.cat == "stitch":
-                self.request_stitch()
+                self._api_executor.submit(self.request_stitch).add_done_callback(
+                    self._log_api_failure)
+            elif action.cat == "stop":
+                self._api_executor.shutdown(wait=True)
+                return
 
-    def snap_and_rec(self, obstacle_id_with_signal: str) -> None:
+    def snap_and_rec(self, obstacle_id_with_signal: str) -> Optional[dict]:
         """
         RPi snaps an image and calls the API for image-rec.
-        The response is then forwarded back to the android
+        The movement lock is released as soon as the final result is known, see `_handle_rec_result` for the rest
         :param obstacle_id_with_signal: the current obstacle ID followed by underscore followed by signal
+        :return: the image-rec results, or None if the API request failed
         """
         obstacle_id, signal = obstacle_id_with_signal.split("_")
-        self.logger.info(f"Capturing image for obstacle id: {obstacle_id}")
+        self.logger.info("Capturing image for obstacle id: %s", obstacle_id)
         self.android_queue.put(AndroidMessage(
             "info", f"Capturing image for obstacle id: {obstacle_id}"))
-        url = f"http://{API_IP}:{API_PORT}/image"
-        filename = f"{int(time.time())}_{obstacle_id}_{signal}.jpg"
-
-        con_file = "PiLCConfig9.txt"
-        Home_Files = []
-        Home_Files.append(os.getlogin())
-        config_file = "/home/" + Home_Files[0] + "/" + con_file
-
-        extns = ['jpg', 'png', 'bmp', 'rgb', 'yuv420', 'raw']
-        shutters = [-2000, -1600, -1250, -1000, -800, -640, -500, -400, -320, -288, -250, -240, -200, -160, -144, -125, -120, -100, -96, -80, -60, -50, -48, -40, -30, -25, -20, -
-                    15, -13, -10, -8, -6, -5, -4, -3, 0.4, 0.5, 0.6, 0.8, 1, 1.1, 1.2, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 15, 20, 25, 30, 40, 50, 60, 75, 100, 112, 120, 150, 200, 220, 230, 239, 435]
-        meters = ['centre', 'spot', 'average']
-        awbs = ['off', 'auto', 'incandescent', 'tungsten',
-                'fluorescent', 'indoor', 'daylight', 'cloudy']
-        denoises = ['off', 'cdn_off', 'cdn_fast', 'cdn_hq']
-
-        config = []
-        with open(config_file, "r") as file:
-            line = file.readline()
-            while line:
-                config.append(line.strip())
-                line = file.readline()
-            config = list(map(int, config))
-        mode = config[0]
-        speed = config[1]
-        gain = config[2]
-        brightness = config[3]
-        contrast = config[4]
-        red = config[6]
-        blue = config[7]
-        ev = config[8]
-        extn = config[15]
-        saturation = config[19]
-        meter = config[20]
-        awb = config[21]
-        sharpness = config[22]
-        denoise = config[23]
-        quality = config[24]
-
-        retry_count = 0
-
-        while True:
-
-            retry_count += 1
-
-            shutter = shutters[speed]
-            if shutter < 0:
-                shutter = abs(1/shutter)
-            sspeed = int(shutter * 1000000)
-            if (shutter * 1000000) - int(shutter * 1000000) > 0.5:
-                sspeed += 1
-
-            rpistr = "libcamera-still -e " + \
-                extns[extn] + " -n -t 500 -o " + filename
-            rpistr += " --brightness " + \
-                str(brightness/100) + " --contrast " + str(contrast/100)
-            rpistr += " --shutter " + str(sspeed)
-            if ev != 0:
-                rpistr += " --ev " + str(ev)
-            if sspeed > 1000000 and mode == 0:
-                rpistr += " --gain " + str(gain) + " --immediate "
-            else:
-                rpistr += " --gain " + str(gain)
-                if awb == 0:
-                    rpistr += " --awbgains " + str(red/10) + "," + str(blue/10)
-                else:
-                    rpistr += " --awb " + awbs[awb]
-            rpistr += " --metering " + meters[meter]
-            rpistr += " --saturation " + str(saturation/10)
-            rpistr += " --sharpness " + str(sharpness/10)
-            rpistr += " --quality " + str(quality)
-            rpistr += " --denoise " + denoises[denoise]
-            rpistr += " --metadata - --metadata-format txt >> PiLibtext.txt"
+        now = int(time.time())
+        filename = f"{now}_{obstacle_id}_{signal}.jpg"
 
-            os.system(rpistr)
+        # Only the shutter speed is adjusted between retries
+        speed = self.cam_speed
 
-            self.logger.debug("Requesting from image API")
-
-            response = requests.post(
-                url, files={"file": (filename, open(filename, 'rb'))})
-
-            if response.status_code != 200:
-                self.logger.error(
-                    "Something went wrong when requesting path from image-rec API. Please try again.")
-                return
+        try:
+            retry_count = 0
+
+            while True:
+
+                retry_count += 1
+
+                shutter = _SHUTTERS[speed]
+                if shutter < 0:
+                    shutter = abs(1/shutter)
+                sspeed = int(shutter * 1000000)
+                if (shutter * 1000000) - int(shutter * 1000000) > 0.5:
+                    sspeed += 1
+
+                if sspeed != self._cam_exposure:
+                    self._camera.set_controls({"ExposureTime": sspeed})
+                    self._cam_exposure = sspeed
+                    # New controls take a few frames to reach the sensor
+                    for _ in range(3):
+                        self._camera.capture_metadata()
+                request = self._camera.capture_request()
+                try:
+                    # Encoded into memory, the JPEG never goes through the SD card
+                    buffer = io.BytesIO()
+                    request.save("main", buffer, format="jpeg")
+                    metadata = request.get_metadata()
+                finally:
+                    request.release()
+
+                # Metadata is appended to PiLibtext.txt, as libcamera-still used to do
+                with open("PiLibtext.txt", "a") as file:
+                    file.writelines(f"{key}={value}\n" for key, value in metadata.items())
+
+                self.logger.debug("Requesting from image API")
+
+                results = self.request_image_rec(filename, buffer.getvalue(), obstacle_id, signal)
+                if results is None:
+                    return None
+
+                # Higher brightness retry
+
+                if results['image_id'] != 'NA' or retry_count > 6:
+                    break
+                elif retry_count > 3:
+                    self.logger.info("Image recognition results: %s", results)
+                    self.logger.info("Recapturing with lower shutter speed...")
+                    speed -= 1
+                elif retry_count <= 3:
+                    self.logger.info("Image recognition results: %s", results)
+                    self.logger.info("Recapturing with higher shutter speed...")
+                    speed += 1
+
+        finally:
+            # release lock so that bot can continue moving, also when the API could not be reached
+            self.movement_lock.release()
+            try:
+                self.retrylock.release()
+            except:
+                pass
 
-            results = json.loads(response.content)
+        return results
 
-            # Higher brightness retry
+    def _log_api_failure(self, future: Future) -> None:
+        """
+        Callback for a finished algo or stitch request, which would otherwise fail silently in the executor
+        :param future: the future returned when the request was submitted
+        """
+        if future.exception() is not None:
+            self.logger.error("API request failed: %s", future.exception())
+            self.android_queue.put(AndroidMessage("error", "Something went wrong when contacting the API."))
 
-            if results['image_id'] != 'NA' or retry_count > 6:
-                break
-            elif retry_count > 3:
-                self.logger.info(f"Image recognition results: {results}")
-                self.logger.info("Recapturing with lower shutter speed...")
-                speed -= 1
-            elif retry_count <= 3:
-                self.logger.info(f"Image recognition results: {results}")
-                self.logger.info("Recapturing with higher shutter speed...")
-                speed += 1
-
-        # release lock so that bot can continue moving
-        self.movement_lock.release()
+    def _handle_rec_result(self, future: Future) -> None:
+        """
+        Callback for a finished `snap_and_rec`, runs while the robot is already moving on.
+        Records the obstacle as a success or failure and forwards the results to the android
+        :param future: the future returned when `snap_and_rec` was submitted
+        """
         try:
-            self.retrylock.release()
-        except:
-            pass
+            results = future.result()
+        except Exception as e:
+            self.logger.error("Image recognition failed: %s", e)
+            return
+        if results is None:
+            return
 
-        self.logger.info(f"results: {results}")
-        self.logger.info(f"self.obstacles: {self.obstacles}")
-        self.logger.info(
-            f"Image recognition results: {results} ({SYMBOL_MAP.get(results['image_id'])})")
+        self.logger.info("results: %s", results)
+        self.logger.debug("self.obstacles: %s", self.obstacles)
+        self.logger.info("Image recognition results: %s (%s)",
+                         results, SYMBOL_MAP.get(results['image_id']))
 
         if results['image_id'] == 'NA':
             self.failed_obstacles.append(
                 self.obstacles[int(results['obstacle_id'])])
             self.logger.info(
-                f"Added Obstacle {results['obstacle_id']} to failed obstacles.")
-            self.logger.info(f"self.failed_obstacles: {self.failed_obstacles}")
+                "Added Obstacle %s to failed obstacles.", results['obstacle_id'])
+            self.logger.info("self.failed_obstacles: %s", self.failed_obstacles)
         else:
             self.success_obstacles.append(
                 self.obstacles[int(results['obstacle_id'])])
             self.logger.info(
-                f"self.success_obstacles: {self.success_obstacles}")
+                "self.success_obstacles: %s", self.success_obstacles)
         self.android_queue.put(AndroidMessage("image-rec", results))
 
     def request_algo(self, data, robot_x=1, robot_y=1, robot_dir=0, retrying=False):
@@ -501,14 +789,15 @@ class RaspberryPi:
         self.logger.info("Requesting path from algo...")
         self.android_queue.put(AndroidMessage(
             "info", "Requesting path from algo..."))
-        self.logger.info(f"data: {data}")
+        self.logger.info("data: %s", data)
         body = {**data, "big_turn": "0", "robot_x": robot_x,
                 "robot_y": robot_y, "robot_dir": robot_dir, "retrying": retrying}
-        url = f"http://{API_IP}:{API_PORT}/path"
-        response = requests.post(url, json=body)
+        url = self._path_url
+        response = self.http.request(
+            "POST", url, body=json.dumps(body).encode("utf-8"), headers={"Content-Type": "application/json"})
 
         # Error encountered at the server, return early
-        if response.status_code != 200:
+        if response.status != 200:
             self.android_queue.put(AndroidMessage(
                 "error", "Something went wrong when requesting path from Algo API."))
             self.logger.error(
@@ -516,19 +805,22 @@ class RaspberryPi:
             return
 
         # Parse response
-        result = json.loads(response.content)['data']
+        result = json.loads(response.data)['data']
         commands = result['commands']
         path = result['path']
 
         # Log commands received
-        self.logger.debug(f"Commands received from API: {commands}")
+        self.logger.debug("Commands received from API: %s", commands)
 
         # Put commands and paths into respective queues
         self.clear_queues()
-        for command in commands:
-            self.command_queue.put(command)
+        generation = self.plan_generation.value
+        # Each plan goes through the queues as a single item, which the consumers iterate over locally.
+        # The obstacles snapped on the way go along with it, a retry keeps the ones of the first plan
+        self.command_queue.put((generation, commands, [] if retrying else data['obstacles']))
         for position in path[1:]:  # ignore first element as it is the starting position of the robot
-            self.path_queue.put(position)
+            self.path_queue.put(position['x'], position['y'], position['d'])
+        self.plan_queued.set()
 
         self.android_queue.put(AndroidMessage(
             "info", "Commands and path received Algo API. Robot is ready to move."))
@@ -537,11 +829,11 @@ class RaspberryPi:
 
     def request_stitch(self):
         """Sends a stitch request to the image recognition API to stitch the different images together"""
-        url = f"http://{API_IP}:{API_PORT}/stitch"
-        response = requests.get(url)
+        url = self._stitch_url
+        response = self.http.request("GET", url)
 
         # If error, then log, and send error to Android
-        if response.status_code != 200:
+        if response.status != 200:
             # Notify android
             self.android_queue.put(AndroidMessage(
                 "error", "Something went wrong when requesting stitch from the API."))
@@ -554,10 +846,16 @@ class RaspberryPi:
 
     def clear_queues(self):
         """Clear both command and path queues"""
-        while not self.command_queue.empty():
-            self.command_queue.get()
-        while not self.path_queue.empty():
-            self.path_queue.get()
+        # Batches already taken by command_follower are dropped once it sees the new generation
+        self.plan_generation.value += 1
+        self.plan_queued.clear()
+        self.path_queue.clear()
+        # The queues are shared with the other processes, so they are drained in place rather than replaced
+        while True:
+            try:
+                self.command_queue.get_nowait()
+            except queue.Empty:
+                break
 
     def check_api(self) -> bool:
         """Check whether image recognition and algorithm API server is up and running
@@ -565,23 +863,33 @@ class RaspberryPi:
         Returns:
             bool: True if running, False if not.
         """
+        # A down server refuses the connection straight away, so it is found without waiting on an HTTP timeout
+        try:
+            socket.create_connection((API_IP, API_PORT), timeout=0.2).close()
+        except socket.timeout:
+            self.logger.warning("API Timeout")
+            return False
+        except OSError:
+            self.logger.warning("API Connection Error")
+            return False
+
         # Check image recognition API
-        url = f"http://{API_IP}:{API_PORT}/status"
+        url = self._status_url
         try:
-            response = requests.get(url, timeout=1)
-            if response.status_code == 200:
+            response = self.http.request("GET", url, timeout=1)
+            if response.status == 200:
                 self.logger.debug("API is up!")
                 return True
             return False
         # If error, then log, and return False
-        except ConnectionError:
+        except urllib3.exceptions.NewConnectionError:
             self.logger.warning("API Connection Error")
             return False
-        except requests.Timeout:
+        except urllib3.exceptions.TimeoutError:
             self.logger.warning("API Timeout")
             return False
         except Exception as e:
-            self.logger.warning(f"API Exception: {e}")
+            self.logger.warning("API Exception: %s", e)
             return False
 
 
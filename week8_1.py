@@ -422,27 +422,26 @@ class RaspberryPi:
             if (shutter * 1000000) - int(shutter * 1000000) > 0.5:
                 sspeed += 1
 
-            rpistr = "libcamera-still -e " + \
-                extns[extn] + " -n -t 500 -o " + filename
-            rpistr += " --brightness " + \
-                str(brightness/100) + " --contrast " + str(contrast/100)
-            rpistr += " --shutter " + str(sspeed)
+            parts = ["libcamera-still", "-e", extns[extn], "-n", "-t", "500", "-o", filename,
+                     "--brightness", str(brightness/100), "--contrast", str(contrast/100),
+                     "--shutter", str(sspeed)]
             if ev != 0:
-                rpistr += " --ev " + str(ev)
+                parts.extend(["--ev", str(ev)])
             if sspeed > 1000000 and mode == 0:
-                rpistr += " --gain " + str(gain) + " --immediate "
+                parts.extend(["--gain", str(gain), "--immediate"])
             else:
-                rpistr += " --gain " + str(gain)
+                parts.extend(["--gain", str(gain)])
                 if awb == 0:
-                    rpistr += " --awbgains " + str(red/10) + "," + str(blue/10)
+                    parts.extend(["--awbgains", f"{red/10},{blue/10}"])
                 else:
-                    rpistr += " --awb " + awbs[awb]
-            rpistr += " --metering " + meters[meter]
-            rpistr += " --saturation " + str(saturation/10)
-            rpistr += " --sharpness " + str(sharpness/10)
-            rpistr += " --quality " + str(quality)
-            rpistr += " --denoise " + denoises[denoise]
-            rpistr += " --metadata - --metadata-format txt >> PiLibtext.txt"
+                    parts.extend(["--awb", awbs[awb]])
+            parts.extend(["--metering", meters[meter],
+                          "--saturation", str(saturation/10),
+                          "--sharpness", str(sharpness/10),
+                          "--quality", str(quality),
+                          "--denoise", denoises[denoise],
+                          "--metadata", "-", "--metadata-format", "txt", ">>", "PiLibtext.txt"])
+            rpistr = " ".join(parts)
 
             os.system(rpistr)
 